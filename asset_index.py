@@ -0,0 +1,299 @@
+import argparse
+import os
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from PIL import Image
+from image_index import IMAGE_EXTENSIONS
+from image_metadata import DEFAULT_CACHE_DIR, DECODE_ERRORS, probe_image, hash_file
+
+# Largest difference in perceptual hash bits for two images to count as the same artwork
+NEAR_DUPLICATE_DISTANCE = 3
+
+# Bits in the perceptual hash
+PHASH_BITS = 64
+
+# Near-duplicates are confirmed pixel by pixel at no more than this width, in blocks of this many pixels;
+# no block may differ by more than the given mean level in any colour, so a changed word or number keeps cards apart
+COMPARE_MAX_WIDTH = 512
+COMPARE_BLOCK = 8
+COMPARE_MAX_BLOCK_DIFFERENCE = 8
+
+
+def perceptual_hash(image_path):
+    """Return a 64-bit difference hash of the image: brightness steps across a 9x8 greyscale thumbnail
+
+    Re-encoding, resizing or converting the file between formats barely
+    changes the hash, so copies of the same artwork land a few bits apart.
+    """
+    with Image.open(image_path) as img:
+        # JPEGs can be decoded at a fraction of their size, which is all a 9x8 thumbnail needs
+        img.draft('L', (img.width // 8 or 1, img.height // 8 or 1))
+        pixels = img.convert('L').resize((9, 8), Image.LANCZOS).tobytes()
+
+    value = 0
+    for row in range(8):
+        for column in range(8):
+            value = (value << 1) | (pixels[row * 9 + column] > pixels[row * 9 + column + 1])
+    # SQLite integers are signed 64-bit
+    return value - (1 << PHASH_BITS) if value >= 1 << (PHASH_BITS - 1) else value
+
+
+def describe_asset(image_path):
+    """Return (sha256, phash, width, height, format, mode) for an image file, or None if it cannot be read"""
+    try:
+        metadata = probe_image(image_path)
+        return (hash_file(image_path), perceptual_hash(image_path), metadata['width'], metadata['height'],
+                metadata['format'], metadata['mode'])
+    except DECODE_ERRORS:
+        # A header can read fine with the pixel data behind it truncated
+        return None
+
+
+def same_artwork(first_path, second_path):
+    """Return True if two images show the same picture apart from re-encoding and resizing noise
+
+    Both are scaled to the smaller one's size (at most COMPARE_MAX_WIDTH wide)
+    and compared in COMPARE_BLOCK-pixel blocks: compression noise averages out
+    within a block, while a changed word, number or symbol shifts at least
+    one block well past COMPARE_MAX_BLOCK_DIFFERENCE.
+    """
+    with Image.open(first_path) as first, Image.open(second_path) as second:
+        width = min(first.width, second.width, COMPARE_MAX_WIDTH)
+        height = round(width * first.height / first.width)
+        size = (width, height)
+        for img in (first, second):
+            img.draft('RGB', size)
+        first_pixels = np.asarray(first.convert('RGB').resize(size, Image.LANCZOS), dtype=np.int16)
+        second_pixels = np.asarray(second.convert('RGB').resize(size, Image.LANCZOS), dtype=np.int16)
+
+    difference = np.abs(first_pixels - second_pixels)
+    rows, columns = height // COMPARE_BLOCK, width // COMPARE_BLOCK
+    blocks = difference[:rows * COMPARE_BLOCK, :columns * COMPARE_BLOCK].reshape(
+        rows, COMPARE_BLOCK, columns, COMPARE_BLOCK, 3).mean(axis=(1, 3))
+    return blocks.size > 0 and float(blocks.max()) <= COMPARE_MAX_BLOCK_DIFFERENCE
+
+
+def hash_distance(first, second):
+    """Return the number of bits that differ between two perceptual hashes"""
+    return bin((first ^ second) & ((1 << PHASH_BITS) - 1)).count('1')
+
+
+class AssetIndex:
+    """Content and perceptual hashes, dimensions and format of every image in a fronts library
+
+    Stored in SQLite next to the other caches and brought up to date by
+    update(), which lists the directory and only reads files whose
+    modification time or size changed since they were indexed.  The index
+    groups files holding the same artwork, byte-identical or near-identical
+    (re-encoded, resized, converted), so each one is encoded and embedded
+    once.  With cache_dir=None the index is kept in memory for this run only.
+    """
+
+    def __init__(self, image_dir, cache_dir=DEFAULT_CACHE_DIR):
+        self.image_dir = os.path.abspath(image_dir)
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            db_path = os.path.join(cache_dir, "asset_index.sqlite")
+        else:
+            db_path = ":memory:"
+        self._db = sqlite3.connect(db_path)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS assets ("
+            " path TEXT PRIMARY KEY, directory TEXT, mtime_ns INTEGER, size INTEGER,"
+            " sha256 TEXT, phash INTEGER, width INTEGER, height INTEGER, format TEXT, mode TEXT)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS assets_directory ON assets (directory)")
+        # Verdicts of same_artwork() by content, so each pair of files is only compared once
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS comparisons ("
+            " first_sha256 TEXT, second_sha256 TEXT, same INTEGER, PRIMARY KEY (first_sha256, second_sha256))"
+        )
+        self._assets = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def update(self, workers=1):
+        """Index new and changed files and drop removed ones, returning (added, changed, removed, unchanged)"""
+        indexed = {path: (mtime_ns, size) for path, mtime_ns, size in self._db.execute(
+            "SELECT path, mtime_ns, size FROM assets WHERE directory = ?", (self.image_dir,))}
+
+        stale = []
+        present = set()
+        with os.scandir(self.image_dir) as entries:
+            for entry in entries:
+                if not entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                    continue
+                stat = entry.stat()
+                present.add(entry.path)
+                if indexed.get(entry.path) != (stat.st_mtime_ns, stat.st_size):
+                    stale.append((entry.path, stat.st_mtime_ns, stat.st_size))
+
+        removed = [path for path in indexed if path not in present]
+        self._db.executemany("DELETE FROM assets WHERE path = ?", [(path,) for path in removed])
+
+        paths = [path for path, mtime_ns, size in stale]
+        if workers > 1 and len(paths) > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                descriptions = list(executor.map(describe_asset, paths, chunksize=16))
+        else:
+            descriptions = [describe_asset(path) for path in paths]
+        # Unreadable files stay out of the index, so they are never offered as a copy of anything
+        self._db.executemany(
+            "INSERT OR REPLACE INTO assets VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [(path, self.image_dir, mtime_ns, size) + description
+             for (path, mtime_ns, size), description in zip(stale, descriptions) if description is not None]
+        )
+        self._db.commit()
+        self._assets = None
+
+        changed = sum(1 for path, mtime_ns, size in stale if path in indexed)
+        return len(stale) - changed, changed, len(removed), len(present) - len(stale)
+
+    def assets(self):
+        """Return {path: asset record} for every indexed file in the directory"""
+        if self._assets is None:
+            rows = self._db.execute(
+                "SELECT path, sha256, phash, width, height, format, mode, size FROM assets WHERE directory = ?",
+                (self.image_dir,))
+            self._assets = {path: {'sha256': sha256, 'phash': phash, 'width': width, 'height': height,
+                                   'format': image_format, 'mode': mode, 'size': size}
+                            for path, sha256, phash, width, height, image_format, mode, size in rows}
+        return self._assets
+
+    def duplicate_groups(self, image_paths=None, max_distance=NEAR_DUPLICATE_DISTANCE):
+        """Return lists of paths holding the same artwork, best copy first
+
+        Files with the same content hash always group together; with
+        max_distance > 0 so do files whose perceptual hashes differ in at
+        most that many bits, have the same aspect ratio and pass a pixel
+        comparison (same_artwork).  The best copy has the most pixels, then prefers
+        lossless formats.  Only the given paths (all indexed files by
+        default) are considered.
+        """
+        assets = self.assets()
+        paths = sorted(os.path.abspath(path) for path in image_paths) if image_paths is not None else sorted(assets)
+        paths = [path for path in paths if path in assets]
+        parent = {path: path for path in paths}
+
+        def find(path):
+            while parent[path] != path:
+                parent[path] = parent[parent[path]]
+                path = parent[path]
+            return path
+
+        def union(first, second):
+            parent[find(first)] = find(second)
+
+        # Buckets keyed by an exact value: any two paths in one bucket are candidates
+        buckets = {}
+        for path in paths:
+            buckets.setdefault(('sha256', assets[path]['sha256']), []).append(path)
+        if max_distance > 0:
+            # Two hashes within max_distance bits agree exactly on at least one of max_distance + 1 bands
+            band_count = max_distance + 1
+            band_edges = [PHASH_BITS * band // band_count for band in range(band_count + 1)]
+            for path in paths:
+                phash = assets[path]['phash'] & ((1 << PHASH_BITS) - 1)
+                for band in range(band_count):
+                    low, high = band_edges[band], band_edges[band + 1]
+                    buckets.setdefault((band, (phash >> low) & ((1 << (high - low)) - 1)), []).append(path)
+
+        for (kind, value), bucket_paths in buckets.items():
+            if kind == 'sha256':
+                for other in bucket_paths[1:]:
+                    union(bucket_paths[0], other)
+                continue
+            for index, path in enumerate(bucket_paths):
+                for other in bucket_paths[index + 1:]:
+                    if find(path) != find(other) and self._near(path, other, max_distance):
+                        union(path, other)
+
+        groups = {}
+        for path in paths:
+            groups.setdefault(find(path), []).append(path)
+        return [sorted(group, key=lambda path: self._quality(assets[path]), reverse=True)
+                for group in groups.values() if len(group) > 1]
+
+    def canonical_paths(self, image_paths, max_distance=NEAR_DUPLICATE_DISTANCE):
+        """Return {image_path: best copy} for each of the given paths that is a copy of another one
+
+        Paths are returned in the form they were given.
+        """
+        given = {os.path.abspath(image_path): image_path for image_path in image_paths}
+        canonical = {}
+        for group in self.duplicate_groups(image_paths, max_distance):
+            for path in group[1:]:
+                canonical[given[path]] = given[group[0]]
+        return canonical
+
+    def close(self):
+        """Write the index to disk and close it"""
+        self._db.commit()
+        self._db.close()
+
+    def _near(self, first_path, second_path, max_distance):
+        first, second = self.assets()[first_path], self.assets()[second_path]
+        if hash_distance(first['phash'], second['phash']) > max_distance:
+            return False
+        # Near-duplicates must also share an aspect ratio, so crops of the same art stay apart
+        if abs(first['width'] * second['height'] - second['width'] * first['height']) > \
+                0.01 * first['width'] * second['height']:
+            return False
+
+        pair = tuple(sorted((first['sha256'], second['sha256'])))
+        row = self._db.execute("SELECT same FROM comparisons WHERE first_sha256 = ? AND second_sha256 = ?",
+                               pair).fetchone()
+        if row:
+            return bool(row[0])
+        same = same_artwork(first_path, second_path)
+        self._db.execute("INSERT OR REPLACE INTO comparisons VALUES (?, ?, ?)", pair + (int(same),))
+        return same
+
+    @staticmethod
+    def _quality(asset):
+        return (asset['width'] * asset['height'], asset['format'] != 'JPEG', asset['size'])
+
+
+def parse_args():
+    """Parse command line options"""
+    parser = argparse.ArgumentParser(description="Update the asset index of a fronts library and report duplicate artwork")
+    parser.add_argument('image_dir', nargs='?', default="assets/fronts",
+                        help="directory of card images (default: assets/fronts)")
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR,
+                        help=f"directory holding asset_index.sqlite (default: {DEFAULT_CACHE_DIR})")
+    parser.add_argument('--max-distance', type=int, default=NEAR_DUPLICATE_DISTANCE, metavar='BITS',
+                        help=f"perceptual hash bits two files may differ by and still count as the same artwork; "
+                             f"0 reports byte-identical files only (default: {NEAR_DUPLICATE_DISTANCE})")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, metavar='N',
+                        help="hash new files in N worker processes (default: number of CPUs)")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+
+    if not os.path.exists(args.image_dir):
+        print(f"Image directory not found: {args.image_dir}")
+        return
+
+    with AssetIndex(args.image_dir, args.cache_dir) as asset_index:
+        added, changed, removed, unchanged = asset_index.update(args.workers)
+        print(f"Indexed {args.image_dir}: {added} added, {changed} changed, {removed} removed, {unchanged} unchanged")
+
+        groups = asset_index.duplicate_groups(max_distance=args.max_distance)
+        assets = asset_index.assets()
+        for group in groups:
+            print(f"\nSame artwork in {len(group)} files (keeping the first):")
+            for path in group:
+                asset = assets[path]
+                print(f"  {os.path.basename(path)}  {asset['width']}x{asset['height']} {asset['format']} "
+                      f"{asset['size'] // 1024} KiB")
+        duplicate_files = sum(len(group) - 1 for group in groups)
+        print(f"\n{len(groups)} groups of duplicate artwork, {duplicate_files} redundant files")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,368 @@
+import argparse
+import json
+import os
+import time
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+from io import StringIO
+
+from cards_xml import read_order
+from image_index import ImageIndex
+from image_metadata import ImageMetadataStore, DEFAULT_CACHE_DIR
+from image_resample import ResampleCache, RESAMPLE_DPI_CHOICES
+from image_bleed import BleedCache, BLEED_MODES
+from color_management import ColorCache, SRGB_PROFILE, load_profile
+from image_object_cache import ImageObjectCache, DEFAULT_CACHE_MB
+from page_template import PageTemplate
+from gang_sheets import pack_orders, separate_sheet_count, write_manifest, sheet_orders
+from cut_guides import GUIDE_STYLES
+from sheet_layout import LAYOUTS, DEFAULT_LAYOUT, get_layout
+from xml_make_fronts import (check_and_install_ghostscript, check_images_exist, create_slot_table,
+                             create_overlay_document, render_overlay_pages, write_document)
+
+# Everything a batch worker keeps between the orders it renders, set up once per process
+_worker_state = {}
+
+
+def find_orders(source):
+    """Return [(order_name, xml_path)] from a directory of XML files or a manifest listing one path per line"""
+    if os.path.isdir(source):
+        xml_paths = [os.path.join(source, filename) for filename in sorted(os.listdir(source))
+                     if filename.lower().endswith('.xml')]
+    else:
+        # Manifest paths are relative to the manifest; blank lines and # comments are skipped
+        manifest_dir = os.path.dirname(source)
+        with open(source) as f:
+            xml_paths = [os.path.join(manifest_dir, line.strip()) for line in f
+                         if line.strip() and not line.lstrip().startswith('#')]
+
+    orders = []
+    seen_names = {}
+    for xml_path in xml_paths:
+        name = os.path.splitext(os.path.basename(xml_path))[0]
+        if name in seen_names:
+            raise ValueError(f"Orders {seen_names[name]} and {xml_path} would both be written to {name}.pdf")
+        seen_names[name] = xml_path
+        orders.append((name, xml_path))
+    return orders
+
+def check_order(xml_path, image_index):
+    """Parse and check one order, returning (slot_table, problems)"""
+    try:
+        order = read_order(xml_path)
+    except (OSError, ET.ParseError) as e:
+        return None, [f"Cannot read {xml_path}: {e}"]
+    if order['problems']:
+        return None, order['problems']
+
+    slot_table = create_slot_table(order['fronts'])
+    if slot_table.collisions:
+        return None, [f"Slot {slot} claimed by {first_id} and {second_id}"
+                      for slot, first_id, second_id in slot_table.collisions]
+    if not len(slot_table):
+        return None, ["No cards in <fronts>"]
+
+    missing_images, existing_images = check_images_exist(slot_table, image_index)
+    if missing_images:
+        return None, [f"Missing image for slot {slot}: {card_id}" for slot, card_id in missing_images]
+    return slot_table, []
+
+def init_worker(layout, image_index, image_metadata, image_sources, guide_style, x_offset, template_path,
+                has_ghostscript, cache_mb):
+    """Set up the state shared by every order a worker renders"""
+    _worker_state.update({
+        'layout': layout,
+        'image_index': image_index,
+        'image_metadata': image_metadata,
+        'image_sources': image_sources,
+        'guide_style': guide_style,
+        'x_offset': x_offset,
+        'page_template': PageTemplate(template_path) if template_path else None,
+        'has_ghostscript': has_ghostscript,
+        'image_cache': ImageObjectCache(cache_mb * 1024 * 1024)
+    })
+
+def render_order(name, slot_table, final_pdf):
+    """Render one order to its PDF, returning a summary record with the order's log output"""
+    state = _worker_state
+    image_cache = state['image_cache']
+    hits, misses = image_cache.hits, image_cache.misses
+    start = time.perf_counter()
+    total_pages = slot_table.page_count(state['layout'].cards_per_page)
+
+    log = StringIO()
+    with redirect_stdout(log):
+        packet = create_overlay_document(slot_table, range(total_pages), state['layout'], state['image_index'],
+                                         state['image_metadata'], state['image_sources'], state['guide_style'],
+                                         state['x_offset'], print, image_cache)
+        write_document([packet.getvalue()], final_pdf, state['has_ghostscript'], state['page_template'])
+
+    return {
+        'order': name,
+        'status': 'ok',
+        'output': final_pdf,
+        'pages': total_pages,
+        'cards': len(slot_table) - len(slot_table.gaps()),
+        'seconds': round(time.perf_counter() - start, 3),
+        'bytes': os.path.getsize(final_pdf),
+        'image_cache_hits': image_cache.hits - hits,
+        'image_cache_misses': image_cache.misses - misses,
+        'worker': os.getpid(),
+        'log': log.getvalue()
+    }
+
+def render_gang(jobs, final_pdf, manifest_path, layout, image_index, image_metadata, image_sources, guide_style,
+                x_offset, template_path, has_ghostscript, workers):
+    """Pack the orders onto shared sheets, render them as one PDF and write the slot manifest
+
+    Returns (per-order results, gang summary), or (None, None) if rendering failed.
+    """
+    cards_per_page = layout.cards_per_page
+    start = time.perf_counter()
+    gang_table, placements = pack_orders(jobs, cards_per_page)
+    sheets = sheet_orders(placements, cards_per_page)
+    separate_sheets = separate_sheet_count(jobs, cards_per_page)
+    print(f"Packed {len(jobs)} orders onto {len(sheets)} sheets ({separate_sheets} if printed separately)")
+    for sheet_num, counts in enumerate(sheets):
+        if len(counts) > 1:
+            print(f"  Sheet {sheet_num + 1}: " + ", ".join(f"{name} ({count})" for name, count in counts.items()))
+
+    documents = render_overlay_pages(gang_table, layout, image_index, image_metadata, image_sources, workers,
+                                     None, guide_style, x_offset)
+    if documents is None:
+        return None, None
+    page_template = PageTemplate(template_path) if template_path else None
+    write_document(documents, final_pdf, has_ghostscript, page_template)
+    write_manifest(placements, cards_per_page, manifest_path)
+
+    results = []
+    for name, slot_table in jobs:
+        order_sheets = [sheet_num + 1 for sheet_num, counts in enumerate(sheets) if name in counts]
+        results.append({
+            'order': name,
+            'status': 'ok',
+            'output': final_pdf,
+            'pages': len(order_sheets),
+            'cards': sum(counts.get(name, 0) for counts in sheets),
+            'sheets': order_sheets
+        })
+    gang = {
+        'output': final_pdf,
+        'manifest': manifest_path,
+        'sheets': len(sheets),
+        'separate_sheets': separate_sheets,
+        'shared_sheets': [sheet_num + 1 for sheet_num, counts in enumerate(sheets) if len(counts) > 1],
+        'seconds': round(time.perf_counter() - start, 3),
+        'bytes': os.path.getsize(final_pdf)
+    }
+    return results, gang
+
+def print_summary(results, elapsed):
+    """Print one line per order and the batch totals"""
+    print(f"\n{'Order':<30} {'Status':<7} {'Pages':>6} {'Cards':>6} {'Seconds':>8} {'KiB':>8}")
+    for result in results:
+        if result['status'] == 'ok' and 'sheets' in result:
+            sheet_list = ", ".join(map(str, result['sheets']))
+            print(f"{result['order']:<30} {'ok':<7} {result['pages']:>6} {result['cards']:>6}   sheets {sheet_list}")
+        elif result['status'] == 'ok':
+            print(f"{result['order']:<30} {'ok':<7} {result['pages']:>6} {result['cards']:>6} "
+                  f"{result['seconds']:>8.2f} {result['bytes'] // 1024:>8}")
+        else:
+            print(f"{result['order']:<30} {'failed':<7}")
+            for problem in result['problems'][:5]:
+                print(f"  {problem}")
+            if len(result['problems']) > 5:
+                print(f"  ... {len(result['problems']) - 5} more")
+
+    rendered = [result for result in results if result['status'] == 'ok']
+    print(f"\n{len(rendered)} of {len(results)} orders rendered in {elapsed:.2f}s")
+
+def parse_args():
+    """Parse command line options"""
+    parser = argparse.ArgumentParser(
+        description="Lay out the card fronts for many orders in one run, sharing the image index, image metadata "
+                    "and encoded images between them")
+    parser.add_argument('orders',
+                        help="directory of order XML files, or a manifest file listing one XML path per line")
+    parser.add_argument('--output-dir', default="output/batch",
+                        help="directory for the per-order PDFs and summary.json (default: output/batch)")
+    parser.add_argument('--fronts-dir', default="assets/fronts",
+                        help="directory of card front images (default: assets/fronts)")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, metavar='N',
+                        help="render up to N orders at once in worker processes (default: number of CPUs)")
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR,
+                        help=f"directory for cached image metadata and resampled images (default: {DEFAULT_CACHE_DIR})")
+    parser.add_argument('--cache-mb', type=int, default=DEFAULT_CACHE_MB,
+                        help=f"memory budget per worker for encoded images reused across orders "
+                             f"(default: {DEFAULT_CACHE_MB})")
+    parser.add_argument('--resample-dpi', type=int, choices=RESAMPLE_DPI_CHOICES,
+                        help="resize each image to the exact pixel size for this print DPI before embedding")
+    parser.add_argument('--add-bleed', choices=BLEED_MODES,
+                        help="give images cut to the card size the layout's bleed (1/8in) by mirroring or "
+                             "replicating their edge pixels")
+    parser.add_argument('--color-profile', metavar='PROFILE',
+                        help=f"convert every image once to '{SRGB_PROFILE}' or to the RGB or CMYK ICC profile file "
+                             "given, and embed the images tagged with it")
+    parser.add_argument('--no-compress', action='store_true',
+                        help="skip the Ghostscript pass even if Ghostscript is installed")
+    parser.add_argument('--layout', choices=list(LAYOUTS), default=DEFAULT_LAYOUT,
+                        help=f"sheet layout: paper size and card grid (default: {DEFAULT_LAYOUT})")
+    guides = parser.add_mutually_exclusive_group()
+    guides.add_argument('--guides', choices=sorted(GUIDE_STYLES), default='template',
+                        help="cut guides to draw on every sheet (default: template)")
+    guides.add_argument('--template', metavar='PDF',
+                        help="stamp this template PDF beneath every sheet instead of drawing the cut guides")
+    parser.add_argument('--x-offset-cm', type=float, default=0.0, metavar='CM',
+                        help="shift the cards and edge guides right by this many centimetres (default: 0)")
+    parser.add_argument('--gang', action='store_true',
+                        help="pack all the orders' cards densely onto shared sheets in one gang.pdf, with "
+                             "gang_manifest.csv giving the order and original slot of every position")
+    parser.add_argument('--verbose', action='store_true', help="print every order's card placements")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    start = time.perf_counter()
+
+    if not os.path.exists(args.orders):
+        print(f"Orders not found: {args.orders}")
+        return
+
+    if not os.path.exists(args.fronts_dir):
+        print(f"Fronts directory not found: {args.fronts_dir}")
+        return
+
+    if args.template and not os.path.exists(args.template):
+        print(f"Template PDF not found: {args.template}")
+        return
+
+    if args.color_profile:
+        try:
+            load_profile(args.color_profile)
+        except (OSError, ValueError) as e:
+            print(f"Colour profile not usable: {e}")
+            return
+
+    try:
+        orders = find_orders(args.orders)
+    except ValueError as e:
+        print(f"ERROR: {e}")
+        return
+    print(f"Found {len(orders)} orders")
+
+    layout = get_layout(args.layout)
+    guide_style = 'none' if args.template else args.guides
+    x_offset = args.x_offset_cm * 10 * 72 / 25.4  # Convert cm to points
+    has_ghostscript = False if args.no_compress else check_and_install_ghostscript()
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    # One index of the fronts serves every order
+    image_index = ImageIndex(args.fronts_dir)
+    print(f"Indexed {len(image_index)} images in {args.fronts_dir}")
+
+    results = {}
+    slot_tables = {}
+    for name, xml_path in orders:
+        slot_table, problems = check_order(xml_path, image_index)
+        if problems:
+            results[name] = {'order': name, 'status': 'failed', 'problems': problems}
+        else:
+            slot_tables[name] = slot_table
+    print(f"{len(slot_tables)} orders ready, {len(orders) - len(slot_tables)} with problems")
+
+    # Sizes are read, and images extended, resampled and colour converted, once for all the orders together
+    image_paths = {image_index.path(card_id) for slot_table in slot_tables.values() for card_id in slot_table.card_ids}
+    with ImageMetadataStore(args.cache_dir) as metadata_store:
+        image_metadata = metadata_store.snapshot(image_paths)
+        print(f"Image metadata: {len(image_paths) - metadata_store.probed} cached, "
+              f"{metadata_store.probed} read from headers")
+        for image_path, error in sorted(metadata_store.unreadable.items()):
+            print(f"  Warning: Cannot read image {os.path.basename(image_path)}: {error}")
+        # Cards whose image cannot be read are skipped when their pages are drawn
+        image_paths = set(image_metadata)
+
+        image_sources = None
+        if args.add_bleed:
+            bleed_cache = BleedCache(args.cache_dir, args.add_bleed, metadata_store)
+            image_sources = bleed_cache.prepare(image_paths, layout, args.workers)
+            # Cards are sized from the image actually embedded
+            image_metadata = {image_path: metadata_store.get(source) for image_path, source in image_sources.items()}
+        if args.resample_dpi:
+            resample_cache = ResampleCache(args.cache_dir, args.resample_dpi, metadata_store)
+            image_sources = image_sources or {image_path: image_path for image_path in image_paths}
+            resampled = resample_cache.prepare(set(image_sources.values()), layout.image_width, args.workers)
+            image_sources = {image_path: resampled[source] for image_path, source in image_sources.items()}
+        if args.color_profile:
+            color_cache = ColorCache(args.cache_dir, args.color_profile, metadata_store)
+            image_sources = image_sources or {image_path: image_path for image_path in image_paths}
+            converted = color_cache.prepare(set(image_sources.values()), args.workers)
+            image_sources = {image_path: converted[source] for image_path, source in image_sources.items()}
+
+    # Largest orders first, so a big order started last does not hold up the end of the batch
+    jobs = sorted(slot_tables.items(), key=lambda item: len(item[1]), reverse=True)
+    gang = None
+    if args.gang and jobs:
+        print(f"\nPacking {len(jobs)} orders onto shared sheets...")
+        # Whole sheets follow the input order of the orders, which keeps the stacks easy to sort
+        gang_results, gang = render_gang([(name, slot_tables[name]) for name, xml_path in orders if name in slot_tables],
+                                         os.path.join(args.output_dir, "gang.pdf"),
+                                         os.path.join(args.output_dir, "gang_manifest.csv"), layout, image_index,
+                                         image_metadata, image_sources, guide_style, x_offset, args.template,
+                                         has_ghostscript, args.workers)
+        for result in gang_results or []:
+            results[result['order']] = result
+        if gang is None:
+            for name in slot_tables:
+                results[name] = {'order': name, 'status': 'failed', 'problems': ["Rendering the gang sheets failed"]}
+        jobs = []
+
+    worker_args = (layout, image_index, image_metadata, image_sources, guide_style, x_offset, args.template,
+                   has_ghostscript, args.cache_mb)
+
+    def finish(result):
+        results[result['order']] = result
+        print(f"  {result['order']}: {result['pages']} pages in {result['seconds']:.2f}s "
+              f"(image cache {result['image_cache_hits']} hits, {result['image_cache_misses']} misses)")
+        if args.verbose:
+            print(result['log'], end="")
+
+    workers = max(1, min(args.workers, len(jobs)))
+    if jobs:
+        print(f"\nRendering {len(jobs)} orders...")
+    if workers == 1 and jobs:
+        init_worker(*worker_args)
+        for name, slot_table in jobs:
+            finish(render_order(name, slot_table, os.path.join(args.output_dir, f"{name}.pdf")))
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=worker_args) as executor:
+            futures = {executor.submit(render_order, name, slot_table, os.path.join(args.output_dir, f"{name}.pdf")):
+                       name for name, slot_table in jobs}
+            for future, name in futures.items():
+                try:
+                    finish(future.result())
+                except Exception as e:
+                    results[name] = {'order': name, 'status': 'failed', 'problems': [f"Rendering failed: {e}"]}
+
+    elapsed = time.perf_counter() - start
+    ordered_results = [results[name] for name, xml_path in orders]
+    summary_path = os.path.join(args.output_dir, "summary.json")
+    with open(summary_path, 'w') as f:
+        json.dump({
+            'layout': layout.name,
+            'guides': guide_style,
+            'template': args.template,
+            'compressed': has_ghostscript,
+            'seconds': round(elapsed, 3),
+            'gang': gang,
+            'orders': [{key: value for key, value in result.items() if key != 'log'} for result in ordered_results]
+        }, f, indent=2)
+
+    print_summary(ordered_results, elapsed)
+    if gang:
+        print(f"Gang sheets: {gang['output']} ({gang['sheets']} sheets instead of {gang['separate_sheets']})")
+        print(f"Slot manifest: {gang['manifest']}")
+    print(f"Summary: {summary_path}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,284 @@
+import argparse
+import contextlib
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from PIL import Image
+
+import xml_make_fronts
+from cards_xml import read_order
+from image_index import ImageIndex
+from image_metadata import ImageMetadataStore
+from sheet_layout import LAYOUTS, DEFAULT_LAYOUT, get_layout
+
+# Default scenarios as (slots in the order, image files in the fronts directory)
+DEFAULT_SCENARIOS = [(60, 10), (600, 500), (6000, 5000)]
+
+# Pixel size of the generated dummy card images
+DEFAULT_IMAGE_SIZE = (250, 350)
+
+# A stage counts as a regression when it is this much slower and at least MIN_REGRESSION_SECONDS slower
+DEFAULT_REGRESSION_THRESHOLD = 0.25
+MIN_REGRESSION_SECONDS = 0.05
+
+
+def parse_scenarios(text):
+    """Parse "60:10,600:500" into [(60, 10), (600, 500)]"""
+    scenarios = []
+    for item in text.split(','):
+        slots, files = item.split(':')
+        scenarios.append((int(slots), int(files)))
+    return scenarios
+
+
+def card_id_for(index):
+    """Return a fixed-length synthetic card ID, so no ID is a substring of another"""
+    return f"1Bench{index:08d}Xy"
+
+
+def generate_deck(deck_dir, slots, files, image_size=DEFAULT_IMAGE_SIZE):
+    """Write a synthetic cards.xml and front images for a scenario and return their paths
+
+    The deck uses min(slots, files) distinct cards, dealt round-robin over the
+    slots, and the fronts directory holds files images in total, so larger
+    directories also exercise lookups that have to skip unused files.
+    """
+    fronts_dir = os.path.join(deck_dir, "fronts")
+    os.makedirs(fronts_dir, exist_ok=True)
+
+    for index in range(files):
+        # Cheap but distinct image content, so every file embeds as its own image
+        colour = ((index * 67) % 256, (index * 151) % 256, (index * 211) % 256)
+        image = Image.new('RGB', image_size, colour)
+        image.putpixel((index % image_size[0], (index // image_size[0]) % image_size[1]), (255, 255, 255))
+        image.save(os.path.join(fronts_dir, f"Card {index} ({card_id_for(index)}).jpg"), 'JPEG', quality=85)
+
+    distinct = max(1, min(slots, files))
+    card_slots = {}
+    for slot in range(slots):
+        card_slots.setdefault(slot % distinct, []).append(slot)
+
+    xml_path = os.path.join(deck_dir, "cards.xml")
+    with open(xml_path, 'w') as f:
+        f.write(f"<order><details><quantity>{slots}</quantity><bracket>{slots}</bracket>"
+                f"<stock>(S30) Standard Smooth</stock><foil>false</foil></details><fronts>")
+        for index, card_slot_list in sorted(card_slots.items()):
+            f.write(f"<card><id>{card_id_for(index)}</id><slots>{','.join(map(str, card_slot_list))}</slots>"
+                    f"<name>Card {index}</name><query>card {index}</query></card>")
+        f.write("</fronts><cardback>none</cardback></order>")
+
+    return xml_path, fronts_dir
+
+
+def peak_rss_kb():
+    """Return the peak resident set size of this process in KiB"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, Linux KiB
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def run_pipeline(xml_path, fronts_dir, output_dir, layout_name, workers, compress):
+    """Run the fronts pipeline stage by stage and return per-stage timings, peak RSS and output sizes"""
+    stages = {}
+
+    @contextlib.contextmanager
+    def stage(name):
+        start = time.perf_counter()
+        yield
+        stages[name] = time.perf_counter() - start
+
+    os.makedirs(output_dir, exist_ok=True)
+    layout = get_layout(layout_name)
+    final_pdf = os.path.join(output_dir, "fronts.pdf")
+
+    # The pipeline's progress lines would dominate the larger runs, so they are discarded
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        with stage('parse_xml'):
+            order = read_order(xml_path)
+        with stage('slot_table'):
+            slot_table = xml_make_fronts.create_slot_table(order['fronts'])
+        with stage('image_lookup'):
+            image_index = ImageIndex(fronts_dir)
+            missing_images, existing_images = xml_make_fronts.check_images_exist(slot_table, image_index)
+        with stage('image_metadata'):
+            # In memory, so every run starts cold
+            with ImageMetadataStore(None) as metadata_store:
+                image_paths = {image_index.path(card_id) for card_id in slot_table.card_ids}
+                image_metadata = metadata_store.snapshot(image_paths)
+        with stage('render'):
+            documents = xml_make_fronts.render_overlay_pages(slot_table, layout, image_index, image_metadata,
+                                                             workers=workers, guide_style='template')
+        with stage('write'):
+            xml_make_fronts.write_document(documents, final_pdf, False)
+        if compress:
+            with stage('compress'):
+                xml_make_fronts.compress_pdf(final_pdf, os.path.join(output_dir, "fronts_compressed.pdf"))
+        with stage('split_pages'):
+            page_files = list(xml_make_fronts.write_debug_pages(
+                xml_make_fronts.document_pages(documents), os.path.join(output_dir, "uncompressed_pdfs"),
+                os.path.join(output_dir, "compressed_pdfs"), False))
+        with stage('combine'):
+            xml_make_fronts.combine_pages(page_files, os.path.join(output_dir, "fronts_combined.pdf"))
+
+    outputs = {name: os.path.getsize(os.path.join(output_dir, name))
+               for name in ("fronts.pdf", "fronts_compressed.pdf", "fronts_combined.pdf")
+               if os.path.exists(os.path.join(output_dir, name))}
+    return {
+        'missing_images': len(missing_images),
+        'pages': slot_table.page_count(layout.cards_per_page),
+        'distinct_cards': len(slot_table.card_ids),
+        'stages': stages,
+        'total_seconds': sum(stages.values()),
+        'peak_rss_kb': peak_rss_kb(),
+        'output_bytes': outputs
+    }
+
+
+def run_scenario(slots, files, work_dir, args):
+    """Generate a scenario and run the pipeline on it in a fresh interpreter, so peak RSS is its own"""
+    deck_dir = os.path.join(work_dir, f"deck_{slots}_{files}")
+    if os.path.exists(deck_dir):
+        shutil.rmtree(deck_dir)
+
+    start = time.perf_counter()
+    xml_path, fronts_dir = generate_deck(deck_dir, slots, files, args.image_size)
+    generate_seconds = time.perf_counter() - start
+
+    result_path = os.path.join(deck_dir, "result.json")
+    cmd = [sys.executable, os.path.abspath(__file__), '--run-one', xml_path, fronts_dir,
+           os.path.join(deck_dir, "output"), result_path, '--layout', args.layout, '--workers', str(args.workers)]
+    if args.compress:
+        cmd.append('--compress')
+    subprocess.run(cmd, check=True)
+
+    with open(result_path) as f:
+        result = json.load(f)
+    result.update({
+        'name': f"{slots}_slots_{files}_files",
+        'slots': slots,
+        'files': files,
+        'generate_seconds': generate_seconds
+    })
+    return result
+
+
+def compare_reports(old_report, new_report, threshold=DEFAULT_REGRESSION_THRESHOLD):
+    """Print stage timings of two reports side by side and return the regressions found"""
+    old_scenarios = {scenario['name']: scenario for scenario in old_report['scenarios']}
+    regressions = []
+
+    print(f"\n{'scenario':<28} {'stage':<15} {'old s':>9} {'new s':>9} {'change':>8}")
+    for scenario in new_report['scenarios']:
+        old = old_scenarios.get(scenario['name'])
+        if old is None:
+            continue
+
+        rows = [(name, old['stages'].get(name), seconds) for name, seconds in scenario['stages'].items()]
+        rows.append(('total', old['total_seconds'], scenario['total_seconds']))
+        for name, old_seconds, new_seconds in rows:
+            if old_seconds is None:
+                continue
+            change = (new_seconds - old_seconds) / old_seconds if old_seconds else 0.0
+            regressed = change > threshold and new_seconds - old_seconds > MIN_REGRESSION_SECONDS
+            if regressed:
+                regressions.append((scenario['name'], name, old_seconds, new_seconds))
+            print(f"{scenario['name']:<28} {name:<15} {old_seconds:>9.3f} {new_seconds:>9.3f} "
+                  f"{change:>+7.0%}{'  REGRESSION' if regressed else ''}")
+
+        print(f"{scenario['name']:<28} {'peak RSS MiB':<15} {old['peak_rss_kb'] / 1024:>9.1f} "
+              f"{scenario['peak_rss_kb'] / 1024:>9.1f}")
+    return regressions
+
+
+def parse_args():
+    """Parse command line options"""
+    parser = argparse.ArgumentParser(description="Benchmark the fronts pipeline on synthetic decks")
+    parser.add_argument('--scenarios', type=parse_scenarios, default=DEFAULT_SCENARIOS, metavar='SLOTS:FILES,...',
+                        help="scenarios to run as slot and fronts-directory file counts "
+                             "(default: 60:10,600:500,6000:5000)")
+    parser.add_argument('--image-size', type=lambda text: tuple(map(int, text.split('x'))),
+                        default=DEFAULT_IMAGE_SIZE, metavar='WxH',
+                        help=f"pixel size of the dummy images (default: {DEFAULT_IMAGE_SIZE[0]}x{DEFAULT_IMAGE_SIZE[1]})")
+    parser.add_argument('--layout', choices=list(LAYOUTS), default=DEFAULT_LAYOUT,
+                        help=f"sheet layout to benchmark (default: {DEFAULT_LAYOUT})")
+    parser.add_argument('--workers', type=int, default=1, metavar='N',
+                        help="render pages in N worker processes (default: 1)")
+    parser.add_argument('--compress', action='store_true',
+                        help="include the Ghostscript pass (needs gs on the PATH)")
+    parser.add_argument('--work-dir',
+                        help="directory for generated decks and outputs (default: a temporary directory, removed afterwards)")
+    parser.add_argument('--output', default="benchmark_report.json",
+                        help="JSON report to write (default: benchmark_report.json)")
+    parser.add_argument('--compare', metavar='REPORT',
+                        help="earlier JSON report to compare against; exits with status 1 on regressions")
+    parser.add_argument('--threshold', type=float, default=DEFAULT_REGRESSION_THRESHOLD,
+                        help=f"relative slowdown counted as a regression (default: {DEFAULT_REGRESSION_THRESHOLD})")
+    # Internal: run the pipeline once in this process and write the result
+    parser.add_argument('--run-one', nargs=4, metavar=('XML', 'FRONTS', 'OUTPUT_DIR', 'RESULT'),
+                        help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    if args.run_one:
+        xml_path, fronts_dir, output_dir, result_path = args.run_one
+        result = run_pipeline(xml_path, fronts_dir, output_dir, args.layout, args.workers, args.compress)
+        with open(result_path, 'w') as f:
+            json.dump(result, f)
+        return
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="fronts_benchmark_")
+    os.makedirs(work_dir, exist_ok=True)
+
+    report = {
+        'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'settings': {
+            'layout': args.layout,
+            'workers': args.workers,
+            'compress': args.compress,
+            'image_size': list(args.image_size)
+        },
+        'scenarios': []
+    }
+
+    try:
+        for slots, files in args.scenarios:
+            print(f"Running {slots} slots with {files} files...")
+            result = run_scenario(slots, files, work_dir, args)
+            report['scenarios'].append(result)
+
+            stage_summary = ', '.join(f"{name} {seconds:.2f}s" for name, seconds in result['stages'].items())
+            print(f"  {result['pages']} pages, {result['distinct_cards']} distinct cards: {stage_summary}")
+            print(f"  Total {result['total_seconds']:.2f}s, peak RSS {result['peak_rss_kb'] / 1024:.1f} MiB, "
+                  f"fronts.pdf {result['output_bytes'].get('fronts.pdf', 0) / 1024:.0f} KiB")
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nReport written: {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            old_report = json.load(f)
+        regressions = compare_reports(old_report, report, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} stage(s) regressed by more than {args.threshold:.0%}")
+            sys.exit(1)
+        print("\nNo regressions")
+
+if __name__ == "__main__":
+    main()
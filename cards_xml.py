@@ -0,0 +1,109 @@
+import xml.etree.ElementTree as ET
+
+# Sections of cards.xml that list cards
+CARD_SECTIONS = ('fronts', 'backs')
+
+
+def parse_slots(slots_text):
+    """Parse a comma separated slot list such as "0,3,7" into integers"""
+    return [int(slot.strip()) for slot in slots_text.split(',') if slot.strip()]
+
+
+def iter_order(xml_path):
+    """Stream cards.xml in one pass, yielding (kind, value) items as they are parsed
+
+    kind is one of:
+      'details'  - dict of the order's <details> values (quantity, bracket, stock, ...)
+      'card'     - card record dict with section ('fronts' or 'backs'), id, slots, name and query
+      'cardback' - ID of the common card back
+      'problem'  - (section, description) of an invalid slot, unparseable slot list or slot claimed twice
+
+    Card elements are cleared as soon as they have been handled, so memory does
+    not grow with the size of the order.
+    """
+    quantity = None
+    seen_slots = {section: {} for section in CARD_SECTIONS}
+    stack = []
+
+    for event, elem in ET.iterparse(xml_path, events=('start', 'end')):
+        if event == 'start':
+            stack.append(elem)
+            continue
+
+        stack.pop()
+        parent = stack[-1] if stack else None
+        depth = len(stack)
+
+        if depth == 1 and elem.tag == 'details':
+            details = {child.tag: (child.text or "").strip() for child in elem}
+            if details.get('quantity', "").isdigit():
+                quantity = int(details['quantity'])
+            yield 'details', details
+            elem.clear()
+
+        elif depth == 1 and elem.tag == 'cardback':
+            yield 'cardback', (elem.text or "").strip()
+
+        elif depth == 2 and elem.tag == 'card' and parent.tag in CARD_SECTIONS:
+            section = parent.tag
+            card_id = elem.findtext('id')
+            slots_text = elem.findtext('slots')
+
+            # Skip empty cards
+            if card_id is not None and slots_text is not None:
+                try:
+                    slots = parse_slots(slots_text)
+                except ValueError:
+                    yield 'problem', (section, f"{section}: card {card_id} has an unreadable slot list '{slots_text}'")
+                    slots = []
+
+                for slot in slots:
+                    if slot < 0:
+                        yield 'problem', (section, f"{section}: card {card_id} uses negative slot {slot}")
+                    elif quantity is not None and slot >= quantity:
+                        yield 'problem', (section, f"{section}: card {card_id} uses slot {slot} "
+                                                   f"but the order has {quantity} slots")
+                    elif slot in seen_slots[section]:
+                        yield 'problem', (section, f"{section}: slot {slot} is claimed by both "
+                                                   f"{seen_slots[section][slot]} and {card_id}")
+                    else:
+                        seen_slots[section][slot] = card_id
+
+                yield 'card', {
+                    'section': section,
+                    'id': card_id,
+                    'slots': slots,
+                    'name': elem.findtext('name') or "",
+                    'query': elem.findtext('query') or ""
+                }
+
+            # Drop the finished card so the tree never holds more than one
+            elem.clear()
+            parent.remove(elem)
+
+
+def read_order(xml_path):
+    """Parse cards.xml in one streaming pass and return the whole order as a dict
+
+    Slot problems in <fronts> go in 'problems' and those in <backs> in
+    'back_problems', so a fronts-only run is not stopped by a bad back.
+    """
+    order = {
+        'details': {},
+        'fronts': [],
+        'backs': [],
+        'cardback': None,
+        'problems': [],
+        'back_problems': []
+    }
+    for kind, value in iter_order(xml_path):
+        if kind == 'details':
+            order['details'] = value
+        elif kind == 'card':
+            order[value['section']].append(value)
+        elif kind == 'cardback':
+            order['cardback'] = value
+        else:
+            section, problem = value
+            order['back_problems' if section == 'backs' else 'problems'].append(problem)
+    return order
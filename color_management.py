@@ -0,0 +1,180 @@
+import hashlib
+import os
+from io import BytesIO
+from PIL import Image, ImageCms
+from reportlab.pdfbase import pdfdoc
+from instrumentation import profiler
+from derived_images import save_derived_image, build_derived_images
+
+# Target profile built into Pillow; any other target is the path of an ICC profile file
+SRGB_PROFILE = 'srgb'
+
+# Perceptual intent compresses out-of-gamut artwork into the printer's gamut instead of clipping it
+RENDERING_INTENT = ImageCms.Intent.PERCEPTUAL
+
+# Image mode for each ICC colour space signature, and the PDF colour space it is embedded as
+PROFILE_MODES = {'GRAY': 'L', 'RGB ': 'RGB', 'CMYK': 'CMYK'}
+DEVICE_COLOR_SPACES = {'L': 'DeviceGray', 'RGB': 'DeviceRGB', 'CMYK': 'DeviceCMYK'}
+
+# Transforms built so far in this process, by (source profile digest, source mode, target)
+_transforms = {}
+
+
+def profile_mode(icc_profile):
+    """Return the image mode an ICC profile describes ('L', 'RGB' or 'CMYK'), or None"""
+    return PROFILE_MODES.get(icc_profile[16:20].decode('latin-1')) if len(icc_profile) >= 20 else None
+
+def load_profile(target):
+    """Return the ICC profile bytes for a target: 'srgb' or the path of an ICC profile file
+
+    Raises ValueError if the file is not an RGB or CMYK profile.
+    """
+    if target == SRGB_PROFILE:
+        icc_profile = ImageCms.ImageCmsProfile(ImageCms.createProfile('sRGB')).tobytes()
+        # lcms stamps the creation time into the header; clear it so every run and worker embeds the same bytes
+        return icc_profile[:24] + bytes(12) + icc_profile[36:]
+    with open(target, 'rb') as f:
+        icc_profile = f.read()
+    if profile_mode(icc_profile) not in ('RGB', 'CMYK'):
+        raise ValueError(f"{target} is not an RGB or CMYK ICC profile")
+    return icc_profile
+
+def _transform(source_profile, source_mode, target):
+    """Return the colour transform from a source profile (None for sRGB) to the target, building it once"""
+    key = (hashlib.sha256(source_profile).hexdigest() if source_profile else None, source_mode, target)
+    if key not in _transforms:
+        target_profile = load_profile(target)
+        _transforms[key] = ImageCms.buildTransform(
+            ImageCms.ImageCmsProfile(BytesIO(source_profile)) if source_profile else ImageCms.createProfile('sRGB'),
+            ImageCms.ImageCmsProfile(BytesIO(target_profile)),
+            source_mode, profile_mode(target_profile), RENDERING_INTENT
+        )
+    return _transforms[key]
+
+def convert_image(source_path, output_path, target):
+    """Convert an image to the target profile and write it to output_path with the profile embedded
+
+    The source's own ICC profile is honoured; untagged RGB and greyscale
+    images are taken to be sRGB.  Untagged CMYK is taken to be in the
+    target space already when the target is CMYK, and is otherwise
+    converted without a profile.  Alpha is dropped, as it is when
+    embedding.
+    """
+    target_profile = load_profile(target)
+    target_mode = profile_mode(target_profile)
+    with Image.open(source_path) as img:
+        source_profile = img.info.get('icc_profile')
+        dpi = img.info.get('dpi')
+        if img.mode not in PROFILE_MODES.values():
+            img = img.convert('L' if img.mode == 'LA' else 'RGB')
+        if not source_profile or profile_mode(source_profile) != img.mode:
+            source_profile = None
+            if img.mode == 'L':
+                img = img.convert('RGB')
+        img.load()
+
+        if img.mode == 'CMYK' and not source_profile:
+            converted = img if target_mode == 'CMYK' else img.convert(target_mode)
+        else:
+            # lcms converts the whole pixel buffer in one call
+            converted = ImageCms.applyTransform(img, _transform(source_profile, img.mode, target))
+
+    options = {'icc_profile': target_profile}
+    if dpi:
+        options['dpi'] = dpi
+    return save_derived_image(converted, output_path, png_compress_level=1, **options)
+
+
+class ICCImageXObject(pdfdoc.PDFImageXObject):
+    """reportlab image object whose colour space is the ICC profile it carries
+
+    With icc_profile set the image is written with an [/ICCBased ...] colour
+    space; the profile stream is named by its digest, so every image in a
+    document that uses the same profile shares one copy.
+    """
+
+    icc_profile = None
+
+    def format(self, document):
+        if not self.icc_profile:
+            return super().format(document)
+
+        profile_name = "ICC" + hashlib.sha256(self.icc_profile).hexdigest()[:16]
+        if profile_name in document.idToObject:
+            profile_reference = pdfdoc.PDFObjectReference(profile_name)
+        else:
+            profile_stream = pdfdoc.PDFStream(content=self.icc_profile)
+            profile_stream.dictionary["N"] = {'DeviceGray': 1, 'DeviceRGB': 3, 'DeviceCMYK': 4}[self.colorSpace]
+            profile_stream.dictionary["Alternate"] = pdfdoc.PDFName(self.colorSpace)
+            profile_reference = document.Reference(profile_stream, profile_name)
+
+        stream = pdfdoc.PDFStream(content=self.streamContent)
+        dictionary = stream.dictionary
+        dictionary["Type"] = pdfdoc.PDFName("XObject")
+        dictionary["Subtype"] = pdfdoc.PDFName("Image")
+        dictionary["Width"] = self.width
+        dictionary["Height"] = self.height
+        dictionary["BitsPerComponent"] = self.bitsPerComponent
+        dictionary["ColorSpace"] = pdfdoc.PDFArray([pdfdoc.PDFName("ICCBased"), profile_reference])
+        if self.colorSpace == 'DeviceCMYK' and getattr(self, '_dotrans', 0):
+            dictionary["Decode"] = pdfdoc.PDFArray([1, 0, 1, 0, 1, 0, 1, 0])
+        dictionary["Filter"] = pdfdoc.PDFArray(map(pdfdoc.PDFName, self._filters))
+        dictionary["Length"] = len(self.streamContent)
+        return stream.format(document)
+
+
+def attach_profile(image_object, icc_profile):
+    """Give an image object its file's ICC profile, if the profile matches the pixels as embedded"""
+    if icc_profile and DEVICE_COLOR_SPACES.get(profile_mode(icc_profile)) == image_object.colorSpace:
+        image_object.icc_profile = icc_profile
+    return image_object
+
+
+class ColorCache:
+    """Card images converted to one target ICC profile, cached on disk
+
+    Entries are keyed by the source file's content hash and the target
+    profile's digest, so each image is converted once per profile.  The
+    converted files carry the target profile, which goes into the PDF with
+    them.
+    """
+
+    def __init__(self, cache_dir, target, metadata_store):
+        self.target = target
+        self.metadata_store = metadata_store
+        target_profile = load_profile(target)
+        self.profile_digest = hashlib.sha256(target_profile).hexdigest()
+        self.target_mode = profile_mode(target_profile)
+        self.color_dir = os.path.join(cache_dir, "color")
+        os.makedirs(self.color_dir, exist_ok=True)
+
+    def cache_path(self, image_path, metadata):
+        """Return the cache file for an image converted to the target profile"""
+        # JPEGs stay JPEG; lossless sources stay lossless, in TIFF for CMYK since PNG has no CMYK
+        if metadata['format'] == 'JPEG':
+            extension = '.jpg'
+        else:
+            extension = '.tif' if self.target_mode == 'CMYK' else '.png'
+        content_hash = self.metadata_store.content_hash(image_path)
+        return os.path.join(self.color_dir, f"{content_hash}_{self.profile_digest[:16]}{extension}")
+
+    def prepare(self, image_paths, workers=1, log=print):
+        """Convert every image to the target profile and return {image_path: path_to_embed}
+
+        Images that cannot be decoded are embedded as they are.
+        """
+        sources = {}
+        jobs = []
+        for image_path in sorted(image_paths):
+            output_path = self.cache_path(image_path, self.metadata_store.get(image_path))
+            sources[image_path] = output_path
+            if not os.path.exists(output_path):
+                jobs.append((image_path, output_path, self.target))
+
+        profiler.count('images_color_converted', len(jobs))
+        log(f"Colour profile {self.target} ({self.target_mode}): {len(jobs)} to convert, "
+            f"{len(sources) - len(jobs)} cached")
+
+        for image_path in build_derived_images(convert_image, jobs, workers, log):
+            sources[image_path] = image_path
+        return sources
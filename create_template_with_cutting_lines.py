@@ -1,86 +1,27 @@
-from reportlab.lib.pagesizes import letter, landscape
+import sys
 from reportlab.pdfgen import canvas
-from reportlab.lib.colors import red, black
+from cut_guides import GUIDE_LAYERS, GUIDE_STYLES, draw_guide_layer
+from sheet_layout import DEFAULT_LAYOUT, get_layout
 
-# Set up page size (landscape 8.5x11 inches)
-page_width, page_height = landscape(letter)
+# Sheet layout to draw, optionally named on the command line (landscape 8.5x11 inches by default)
+layout = get_layout(sys.argv[1] if len(sys.argv) > 1 else DEFAULT_LAYOUT)
+page_width, page_height = layout.page_size
 
 # Output PDF filename
-output_filename = "template_cut_lines.pdf"
+output_filename = "template_cut_lines.pdf" if layout.name == DEFAULT_LAYOUT else f"template_cut_lines_{layout.name}.pdf"
 
 # Create canvas
 c = canvas.Canvas(output_filename, pagesize=(page_width, page_height))
 print(f"Page dimensions: {page_width} x {page_height}")
 
-# Original center lines (keeping these)
-c.setLineWidth(0.5)
-c.setStrokeColor(black)
-c.line(0, page_height / 2, page_width, page_height / 2)
-c.line(page_width / 2, 0, page_width / 2, page_height)
-
-# Define x coordinates for vertical dotted lines
-x_coords = [
-    191.9056404,
-    13.3230757,
-    387.4960683,
-    208.9135037,
-    583.0864963,
-    404.5039317,
-    778.6769243,
-    600.0943596,
-]
-
-# Define y coordinates for horizontal dotted lines
-y_coords = [
-    580.9604567,
-    331.511795,
-    280.488205,
-    31.03954328,
-]
-
-# Draw vertical dotted lines at specified x coordinates
-c.setDash([4, 1])  # Set dash pattern: 4 points on, 1 point off
-c.setLineWidth(0.5)
-c.setStrokeColor(black)
-for x in x_coords:
-    c.line(x, 0, x, page_height)
-
-# Draw horizontal dotted lines at specified y coordinates
-for y in y_coords:
-    c.line(0, y, page_width, y)
-
-# Reset to solid lines
-c.setDash([])
-
-# Define points with their coordinates
-points = [
-    ("A", 102.614358, 456.2361258),
-    ("B", 298.204786, 456.2361258),
-    ("C", 493.795214, 456.2361258),
-    ("D", 689.385642, 456.2361258),
-    ("E", 102.614358, 155.7638742),
-    ("F", 298.204786, 155.7638742),
-    ("G", 493.795214, 155.7638742),
-    ("H", 689.385642, 155.7638742)
-]
-
-# Draw red points
-c.setFillColor(red)
-point_radius = 3  # Radius of the points in points (1/72 inch)
-
-for label, x, y in points:
-    # Draw a red circle at each point
-    c.circle(x, y, point_radius, stroke=0, fill=1)
-    
-    # Optionally add labels next to points
-    c.setFillColor(black)
-    c.setFont("Helvetica", 8)
-    c.drawString(x + 5, y + 5, label)
-    c.setFillColor(red)  # Reset to red for next point
+# Centre lines, dotted cut lines and red points with labels, from the same
+# layout description the card scripts draw their guides from
+for layer_name in GUIDE_STYLES['template']:
+    draw_guide_layer(c, GUIDE_LAYERS[layer_name], layout)
 
 # Save the PDF
 c.save()
 print(f"PDF generated: {output_filename}")
 print("\nPoints plotted:")
-for label, x, y in points:
-    print(f"Point {label}: ({x}, {y})")
\ No newline at end of file
+for label, x, y in layout.points:
+    print(f"Point {label}: ({x}, {y})")
@@ -0,0 +1,113 @@
+from reportlab.lib.colors import black, red, lightgrey
+
+# Every guide layer that can be drawn on a sheet.
+#   kind     - 'centre' (page centre lines), 'full' (cut lines across the whole page),
+#              'edge' (cut line segments at the page edges and across the row gaps only)
+#              or 'points' (card centres)
+#   position - 'under' or 'over' the cards
+#   offset   - whether the layer moves with the cards when an x offset is used
+GUIDE_LAYERS = {
+    'centre': {'kind': 'centre', 'position': 'under', 'offset': False,
+               'colour': black, 'dash': [], 'width': 0.5},
+    'full': {'kind': 'full', 'position': 'under', 'offset': False,
+             'colour': black, 'dash': [4, 1], 'width': 0.5},
+    'points': {'kind': 'points', 'position': 'under', 'offset': False,
+               'colour': red, 'label_colour': black, 'radius': 3, 'font': ("Helvetica", 8)},
+    'edge': {'kind': 'edge', 'position': 'over', 'offset': True,
+             'colour': lightgrey, 'dash': [4, 1], 'width': 0.5,
+             'horizontal_length': 2 * 72,    # 2 inches in from each side
+             'vertical_end_length': 1 * 72,  # 1 inch at the top and bottom
+             'vertical_middle_length': 2 * 72},  # 2 inches across each gap between rows
+}
+
+# Named sets of layers, drawn in the order given
+GUIDE_STYLES = {
+    'template': ('centre', 'full', 'points'),  # what template_cut_lines.pdf contains
+    'lines': ('centre', 'full'),  # the template without the debug points and labels
+    'dotted-edges': ('centre', 'full', 'points', 'edge'),  # the white dotted lines script
+    'none': (),
+}
+
+
+def draw_guide_layer(c, layer, layout, x_offset=0):
+    """Draw one guide layer for a sheet layout onto a canvas"""
+    page_width, page_height = layout.page_size
+    c.saveState()
+    if layer['offset']:
+        c.translate(x_offset, 0)
+
+    if layer['kind'] == 'points':
+        c.setFont(*layer['font'])
+        for label, x, y in layout.points:
+            c.setFillColor(layer['colour'])
+            c.circle(x, y, layer['radius'], stroke=0, fill=1)
+            c.setFillColor(layer['label_colour'])
+            c.drawString(x + 5, y + 5, label)
+        c.restoreState()
+        return
+
+    c.setDash(layer['dash'])
+    c.setLineWidth(layer['width'])
+    c.setStrokeColor(layer['colour'])
+
+    if layer['kind'] == 'centre':
+        c.line(0, page_height / 2, page_width, page_height / 2)
+        c.line(page_width / 2, 0, page_width / 2, page_height)
+
+    elif layer['kind'] == 'full':
+        for x in layout.cut_line_x:
+            c.line(x, 0, x, page_height)
+        for y in layout.cut_line_y:
+            c.line(0, y, page_width, y)
+
+    elif layer['kind'] == 'edge':
+        horizontal_length = layer['horizontal_length']
+        for y in layout.cut_line_y:
+            c.line(0, y, horizontal_length, y)
+            c.line(page_width - horizontal_length, y, page_width, y)
+
+        end_length = layer['vertical_end_length']
+        middle_half = layer['vertical_middle_length'] / 2
+        for x in layout.cut_line_x:
+            c.line(x, 0, x, end_length)
+            c.line(x, page_height - end_length, x, page_height)
+            for gap_y in layout.row_gap_centres:
+                c.line(x, gap_y - middle_half, x, gap_y + middle_half)
+
+    else:
+        raise ValueError(f"Unknown guide layer kind: {layer['kind']}")
+
+    c.restoreState()
+
+
+class CutGuides:
+    """Cut guides drawn natively into a reportlab canvas as shared forms
+
+    The layers of a style are drawn once into one form for those under the
+    cards and one for those over them, and every page only references the
+    forms, so the guides cost a few bytes per page and no PDF merging.
+    """
+
+    def __init__(self, overlay_canvas, style, layout, x_offset=0):
+        self.canvas = overlay_canvas
+        self.style = style
+        self.forms = {}
+
+        for position in ('under', 'over'):
+            layers = [GUIDE_LAYERS[name] for name in GUIDE_STYLES[style]
+                      if GUIDE_LAYERS[name]['position'] == position]
+            if not layers:
+                continue
+
+            form_name = f"guides_{position}"
+            overlay_canvas.beginForm(form_name, 0, 0, *layout.page_size)
+            for layer in layers:
+                draw_guide_layer(overlay_canvas, layer, layout, x_offset)
+            overlay_canvas.endForm()
+            self.forms[position] = form_name
+
+    def draw(self, position):
+        """Draw the layers that go under or over the cards on the current page"""
+        form_name = self.forms.get(position)
+        if form_name:
+            self.canvas.doForm(form_name)
@@ -0,0 +1,46 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from image_metadata import DECODE_ERRORS
+
+
+def save_derived_image(img, output_path, png_compress_level=6, **options):
+    """Write an image to its cache file, as JPEG, TIFF or PNG by the file's extension"""
+    # Write to a temporary name so an interrupted run never leaves a half-written cache entry
+    temp_path = output_path + ".tmp"
+    if output_path.endswith('.jpg'):
+        img.save(temp_path, 'JPEG', quality=95, subsampling=0, **options)
+    elif output_path.endswith('.tif'):
+        img.save(temp_path, 'TIFF', compression='tiff_adobe_deflate', **options)
+    else:
+        img.save(temp_path, 'PNG', compress_level=png_compress_level, **options)
+    os.replace(temp_path, output_path)
+    return output_path
+
+
+def _build(function, job):
+    """Run one job, returning the error message if its source image cannot be decoded"""
+    try:
+        function(*job)
+    except DECODE_ERRORS as e:
+        return str(e).strip() or type(e).__name__
+    return None
+
+
+def build_derived_images(function, jobs, workers=1, log=print):
+    """Run function(source_path, output_path, ...) for each job, in a process pool when workers > 1
+
+    A damaged source only fails its own job: it is reported and its path
+    returned in the set of failed sources, for the caller to embed as it is.
+    """
+    if workers > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            errors = list(executor.map(_build, [function] * len(jobs), jobs))
+    else:
+        errors = [_build(function, job) for job in jobs]
+
+    failed = set()
+    for job, error in zip(jobs, errors):
+        if error is not None:
+            log(f"  Warning: Cannot read image {os.path.basename(job[0])}: {error}")
+            failed.add(job[0])
+    return failed
@@ -0,0 +1,81 @@
+import csv
+
+from slot_table import SlotTable
+from sheet_layout import slot_label
+
+
+def pack_orders(orders, cards_per_page):
+    """Pack the cards of several orders onto shared sheets
+
+    orders is a list of (order_name, slot_table).  Blank slots are dropped.
+    Each order's whole sheets come first, so most sheets hold a single order.
+    The leftover cards of every order are then packed onto shared sheets
+    first-fit decreasing, which keeps each order's leftovers on one sheet.
+    If that would need more sheets than the cards strictly require, the
+    leftovers are run together instead, largest first, so only sheet
+    boundaries split an order.
+
+    Returns (slot_table, placements) where placements[slot] is
+    (order_name, order_slot, card_id), or None for a blank slot.
+    """
+    full_sheets = []
+    leftovers = []
+    for name, slot_table in orders:
+        cards = [(name, slot, card_id) for slot, card_id in enumerate(slot_table) if card_id]
+        whole = len(cards) - len(cards) % cards_per_page
+        full_sheets.extend(cards[:whole])
+        if cards[whole:]:
+            leftovers.append(cards[whole:])
+
+    leftovers.sort(key=len, reverse=True)
+    shared_sheets = []
+    for cards in leftovers:
+        for sheet in shared_sheets:
+            if len(sheet) + len(cards) <= cards_per_page:
+                sheet.extend(cards)
+                break
+        else:
+            shared_sheets.append(list(cards))
+
+    leftover_count = sum(len(cards) for cards in leftovers)
+    if len(shared_sheets) > -(-leftover_count // cards_per_page):
+        run = [card for cards in leftovers for card in cards]
+        shared_sheets = [run[start:start + cards_per_page] for start in range(0, len(run), cards_per_page)]
+
+    placements = list(full_sheets)
+    for sheet_num, sheet in enumerate(shared_sheets):
+        placements.extend(sheet)
+        # Blank slots pad every shared sheet but the last
+        if sheet_num < len(shared_sheets) - 1:
+            placements.extend([None] * (cards_per_page - len(sheet)))
+
+    gang_table = SlotTable(len(placements))
+    for slot, placement in enumerate(placements):
+        if placement:
+            gang_table.assign(slot, placement[2])
+    return gang_table, placements
+
+def separate_sheet_count(orders, cards_per_page):
+    """Return the number of sheets the orders take when each is printed on its own"""
+    return sum(slot_table.page_count(cards_per_page) for name, slot_table in orders)
+
+def write_manifest(placements, cards_per_page, manifest_path):
+    """Write a CSV listing the order and original slot of every card on the gang sheets, for sorting after cutting"""
+    with open(manifest_path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['sheet', 'position', 'gang_slot', 'order', 'order_slot', 'card_id'])
+        for slot, placement in enumerate(placements):
+            if placement:
+                sheet_num, position = divmod(slot, cards_per_page)
+                writer.writerow([sheet_num + 1, slot_label(position), slot, *placement])
+
+def sheet_orders(placements, cards_per_page):
+    """Return, for each sheet, the orders on it in order of appearance with their card counts"""
+    sheets = []
+    for start in range(0, len(placements), cards_per_page):
+        counts = {}
+        for placement in placements[start:start + cards_per_page]:
+            if placement:
+                counts[placement[0]] = counts.get(placement[0], 0) + 1
+        sheets.append(counts)
+    return sheets
@@ -0,0 +1,98 @@
+import os
+import numpy as np
+from PIL import Image
+from instrumentation import profiler
+from image_resample import JPEG_MODES
+from derived_images import save_derived_image, build_derived_images
+
+# How the bleed is filled: the numpy.pad mode behind each choice
+BLEED_MODES = {
+    'mirror': 'reflect',  # the pixels next to each edge, reflected across it
+    'replicate': 'edge',  # the outermost row or column repeated outwards
+}
+
+# Modes whose pixels can be padded as they are; anything else is converted to RGB(A) first
+PAD_MODES = ('L', 'LA', 'RGB', 'RGBA', 'CMYK')
+
+
+def needs_bleed(metadata, layout):
+    """Return True if an image is cut to the card size, with no bleed around it
+
+    Decided by the aspect ratio, which is closer to the bare card's than to
+    the card with the layout's bleed added.
+    """
+    aspect_ratio = metadata['height'] / metadata['width']
+    cut_ratio = layout.card_height / layout.card_width
+    bleed_ratio = (layout.card_height + 2 * layout.bleed) / layout.image_width
+    return abs(aspect_ratio - cut_ratio) < abs(aspect_ratio - bleed_ratio)
+
+def bleed_pixels(metadata, layout):
+    """Return how many pixels of bleed an image needs on each side, at the image's own resolution"""
+    return max(1, round(layout.bleed * metadata['width'] / layout.card_width))
+
+def add_bleed(source_path, output_path, pixels, mode):
+    """Extend an image by pixels on every side, filled as the bleed mode says, and write it to output_path"""
+    with Image.open(source_path) as img:
+        info = img.info
+        if img.mode not in PAD_MODES:
+            img = img.convert('RGBA' if img.mode in ('PA', 'RGBa') or 'transparency' in info else 'RGB')
+        pixel_array = np.asarray(img)
+
+    # One array operation pads both axes of every channel
+    padding = ((pixels, pixels), (pixels, pixels)) + ((0, 0),) * (pixel_array.ndim - 2)
+    extended = Image.fromarray(np.pad(pixel_array, padding, mode=BLEED_MODES[mode]), img.mode)
+
+    options = {'dpi': info['dpi']} if info.get('dpi') else {}
+    if info.get('icc_profile'):
+        options['icc_profile'] = info['icc_profile']
+    # reportlab recompresses the pixels when embedding them, so a PNG copy only needs a quick pass
+    return save_derived_image(extended, output_path, png_compress_level=1, **options)
+
+
+class BleedCache:
+    """Card images cut to the card size, extended with generated bleed and cached on disk
+
+    Entries are keyed by the source file's content hash, the bleed mode and
+    the bleed width in pixels, so each image is only extended once per
+    bleed setting.  Images that already carry bleed are used as they are.
+    """
+
+    def __init__(self, cache_dir, mode, metadata_store):
+        self.mode = mode
+        self.metadata_store = metadata_store
+        self.bleed_dir = os.path.join(cache_dir, "bleed")
+        os.makedirs(self.bleed_dir, exist_ok=True)
+
+    def cache_path(self, image_path, metadata, pixels):
+        """Return the cache file for an image extended by pixels on each side"""
+        extension = '.jpg' if metadata['mode'] in JPEG_MODES else '.png'
+        content_hash = self.metadata_store.content_hash(image_path)
+        return os.path.join(self.bleed_dir, f"{content_hash}_{self.mode}_{pixels}px{extension}")
+
+    def prepare(self, image_paths, layout, workers=1, log=print):
+        """Add bleed to every image cut to the card size and return {image_path: path_to_embed}
+
+        Images that cannot be decoded are embedded as they are.
+        """
+        sources = {}
+        jobs = []
+        for image_path in sorted(image_paths):
+            metadata = self.metadata_store.get(image_path)
+            if not needs_bleed(metadata, layout):
+                sources[image_path] = image_path
+                continue
+
+            pixels = bleed_pixels(metadata, layout)
+            output_path = self.cache_path(image_path, metadata, pixels)
+            sources[image_path] = output_path
+            if not os.path.exists(output_path):
+                jobs.append((image_path, output_path, pixels, self.mode))
+
+        extended = sum(1 for image_path, source in sources.items() if source != image_path)
+        profiler.count('images_bled', len(jobs))
+        log(f"Bleed ({self.mode}, {layout.bleed / 72 * 25.4:.2f}mm): {len(jobs)} to extend, "
+            f"{extended - len(jobs)} cached, {len(sources) - extended} already have bleed")
+
+        for image_path in build_derived_images(add_bleed, jobs, workers, log):
+            sources[image_path] = image_path
+        return sources
@@ -0,0 +1,69 @@
+import os
+
+# File extensions accepted as card images
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.bmp')
+
+
+class ImageIndex:
+    """Card ID -> image filename lookup built from a single scan of an image directory
+
+    Card IDs are matched as substrings of filenames, the same rule the scripts
+    have always used.  Instead of listing the directory for every slot, the
+    directory is read once and each filename is cut into windows of the
+    lengths of the IDs being looked up, so resolving a whole order costs one
+    pass over the filenames no matter how many slots or files there are.
+    """
+
+    def __init__(self, image_dir):
+        self.image_dir = image_dir
+        # Keep directory order so the first match is the same one os.listdir gave
+        with os.scandir(image_dir) as entries:
+            self.filenames = [entry.name for entry in entries
+                              if entry.name.lower().endswith(IMAGE_EXTENSIONS)]
+        self._matches = {}
+
+    def __len__(self):
+        return len(self.filenames)
+
+    def resolve(self, card_ids):
+        """Look up every card ID not seen before with one pass over the filenames"""
+        pending = {card_id for card_id in card_ids if card_id and card_id not in self._matches}
+        if not pending:
+            return
+
+        lengths = sorted({len(card_id) for card_id in pending})
+        for card_id in pending:
+            self._matches[card_id] = []
+
+        for filename in self.filenames:
+            found = set()
+            for length in lengths:
+                for start in range(len(filename) - length + 1):
+                    window = filename[start:start + length]
+                    if window in pending and window not in found:
+                        found.add(window)
+                        self._matches[window].append(filename)
+
+    def matches(self, card_id):
+        """Return every filename containing the card ID, in directory order"""
+        if not card_id:
+            return []
+        if card_id not in self._matches:
+            self.resolve([card_id])
+        return self._matches[card_id]
+
+    def find(self, card_id):
+        """Return the first filename containing the card ID, or None"""
+        matches = self.matches(card_id)
+        return matches[0] if matches else None
+
+    def path(self, card_id):
+        """Return the full path of the image for the card ID, or None"""
+        filename = self.find(card_id)
+        return os.path.join(self.image_dir, filename) if filename else None
+
+    def ambiguous(self, card_ids):
+        """Return {card_id: filenames} for IDs that are a substring of several filenames"""
+        self.resolve(card_ids)
+        return {card_id: self._matches[card_id] for card_id in set(card_ids)
+                if card_id and len(self._matches[card_id]) > 1}
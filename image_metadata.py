@@ -0,0 +1,149 @@
+import hashlib
+import os
+import sqlite3
+import struct
+from PIL import Image
+
+# Default location for on-disk caches shared by the scripts
+DEFAULT_CACHE_DIR = "./cache"
+
+# What PIL raises for a damaged file, depending on the format and how far in the damage is
+DECODE_ERRORS = (OSError, SyntaxError, ValueError, struct.error, Image.DecompressionBombError)
+
+
+def probe_image(image_path):
+    """Read dimensions, DPI, colour mode and format from the image header without decoding pixels"""
+    # Image.open only parses the header; pixel data is read on load(), which is never called here
+    with Image.open(image_path) as img:
+        dpi = img.info.get('dpi')
+        return {
+            'width': img.width,
+            'height': img.height,
+            'dpi': (float(dpi[0]), float(dpi[1])) if dpi else None,
+            'mode': img.mode,
+            'format': img.format
+        }
+
+
+def hash_file(path, chunk_size=1 << 20):
+    """Return the SHA-256 hex digest of a file's contents"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ImageMetadataStore:
+    """Image header metadata cached on disk, keyed by path, modification time and size
+
+    Repeat runs over the same fronts folder answer layout questions from the
+    store without opening the image files.  With cache_dir=None the store is
+    kept in memory for the current run only.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR):
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            db_path = os.path.join(cache_dir, "image_metadata.sqlite")
+        else:
+            db_path = ":memory:"
+        self._db = sqlite3.connect(db_path)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS image_metadata ("
+            " path TEXT PRIMARY KEY, mtime_ns INTEGER, size INTEGER,"
+            " width INTEGER, height INTEGER, dpi_x REAL, dpi_y REAL, mode TEXT, format TEXT)"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS content_hashes ("
+            " path TEXT PRIMARY KEY, mtime_ns INTEGER, size INTEGER, sha256 TEXT)"
+        )
+        self._memory = {}
+        self._hashes = {}
+        self.probed = 0
+        # {image_path: error} for the files the last snapshot() could not read as images
+        self.unreadable = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def get(self, image_path):
+        """Return the metadata for an image, probing its header only if the file changed"""
+        path = os.path.abspath(image_path)
+        stat = os.stat(path)
+        key = (path, stat.st_mtime_ns, stat.st_size)
+        if key in self._memory:
+            return self._memory[key]
+
+        row = self._db.execute(
+            "SELECT width, height, dpi_x, dpi_y, mode, format FROM image_metadata"
+            " WHERE path = ? AND mtime_ns = ? AND size = ?", key
+        ).fetchone()
+        if row:
+            width, height, dpi_x, dpi_y, mode, image_format = row
+            metadata = {
+                'width': width,
+                'height': height,
+                'dpi': (dpi_x, dpi_y) if dpi_x is not None else None,
+                'mode': mode,
+                'format': image_format
+            }
+        else:
+            metadata = probe_image(path)
+            self.probed += 1
+            dpi_x, dpi_y = metadata['dpi'] if metadata['dpi'] else (None, None)
+            self._db.execute(
+                "INSERT OR REPLACE INTO image_metadata VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                key + (metadata['width'], metadata['height'], dpi_x, dpi_y,
+                       metadata['mode'], metadata['format'])
+            )
+
+        self._memory[key] = metadata
+        return metadata
+
+    def content_hash(self, image_path):
+        """Return the SHA-256 of an image file, hashing it again only if the file changed"""
+        path = os.path.abspath(image_path)
+        stat = os.stat(path)
+        key = (path, stat.st_mtime_ns, stat.st_size)
+        if key in self._hashes:
+            return self._hashes[key]
+
+        row = self._db.execute(
+            "SELECT sha256 FROM content_hashes WHERE path = ? AND mtime_ns = ? AND size = ?", key
+        ).fetchone()
+        if row:
+            sha256 = row[0]
+        else:
+            sha256 = hash_file(path)
+            self._db.execute("INSERT OR REPLACE INTO content_hashes VALUES (?, ?, ?, ?)", key + (sha256,))
+
+        self._hashes[key] = sha256
+        return sha256
+
+    def snapshot(self, image_paths):
+        """Return {image_path: metadata} for the given paths, for handing to worker processes
+
+        Files that cannot be read as images are left out and recorded in
+        unreadable, so their cards are skipped rather than ending the run.
+        """
+        metadata = {}
+        self.unreadable = {}
+        for image_path in image_paths:
+            try:
+                metadata[image_path] = self.get(image_path)
+            except OSError as e:
+                self.unreadable[image_path] = e
+        return metadata
+
+    def commit(self):
+        """Write new entries to disk, keeping the store open"""
+        self._db.commit()
+
+    def close(self):
+        """Write new entries to disk and close the store"""
+        self.commit()
+        self._db.close()
@@ -0,0 +1,104 @@
+import copy
+import os
+import threading
+from collections import OrderedDict
+from PIL import Image
+from reportlab.lib.utils import _digester
+from jpeg_passthrough import build_jpeg_object
+from color_management import ICCImageXObject, attach_profile
+
+# Default memory budget for encoded images kept between documents
+DEFAULT_CACHE_MB = 512
+
+
+def build_image_object(image_path):
+    """Read an image file and return reportlab's encoded image object for it, named as drawImage names it
+
+    JPEGs that PDF can hold as they are pass straight through; anything
+    else is decoded and compressed by reportlab.  An ICC profile in the file
+    is embedded with the image.
+    """
+    name = _digester(f"{image_path}None".encode())
+    image_object = build_jpeg_object(name, image_path)
+    if image_object is None:
+        image_object = ICCImageXObject(name, image_path)
+        with Image.open(image_path) as img:
+            attach_profile(image_object, img.info.get('icc_profile'))
+    return image_object
+
+def register_image_object(overlay_canvas, image_object):
+    """Register a prebuilt image object in a canvas's document, exactly as drawImage would on first use"""
+    doc = overlay_canvas._doc
+    registered_name = doc.getXObjectName(image_object.name)
+    if registered_name in doc.idToObject:
+        return
+
+    # A document marks the objects it registers, so each one gets its own copy
+    image_object = copy.copy(image_object)
+    overlay_canvas._setXObjects(image_object)
+    doc.Reference(image_object, registered_name)
+    doc.addForm(image_object.name, image_object)
+
+def draw_image_object(overlay_canvas, image_object, image_path, x, y, width, height):
+    """Draw an image file like canvas.drawImage, using an image object already built for that file"""
+    register_image_object(overlay_canvas, image_object)
+    overlay_canvas.drawImage(image_path, x, y, width=width, height=height)
+
+
+class ImageObjectCache:
+    """Encoded image XObjects kept in memory across documents, least recently used evicted first
+
+    Building reportlab's image object is where a card image is read and, for
+    anything but a pass-through JPEG, decoded and compressed.  The object only holds the
+    encoded stream and its size, so a shallow copy can be registered in any
+    later canvas; drawImage then finds it already present and skips the work.  Entries are
+    keyed by path, modification time and size, so an edited file is encoded
+    again.  get() may be called from several threads.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_CACHE_MB * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, image_path):
+        """Return the encoded image object for a file, building it on a miss"""
+        stat = os.stat(image_path)
+        key = (os.path.abspath(image_path), stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            image_object = self._entries.get(key)
+            if image_object is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return image_object
+            self.misses += 1
+
+        # Built outside the lock, so other threads can read and encode images meanwhile
+        image_object = build_image_object(image_path)
+        with self._lock:
+            self._entries[key] = image_object
+            self.size_bytes += len(image_object.streamContent)
+            while self.size_bytes > self.max_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                self.size_bytes -= len(evicted.streamContent)
+        return image_object
+
+    def draw_image(self, overlay_canvas, image_path, x, y, width, height):
+        """Draw an image file like canvas.drawImage, reusing its cached encoded object"""
+        draw_image_object(overlay_canvas, self.get(image_path), image_path, x, y, width, height)
+
+    def stats(self):
+        """Return hit/miss counts and memory use"""
+        return {
+            'entries': len(self._entries),
+            'bytes': self.size_bytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses
+        }
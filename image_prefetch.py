@@ -0,0 +1,79 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from instrumentation import profiler
+from image_object_cache import build_image_object
+
+# Background threads reading and encoding images ahead of the page renderer (0 reads each image when placed)
+DEFAULT_PREFETCH_THREADS = 4
+
+# Images read ahead of the one being placed; bounds the encoded images waiting in memory
+DEFAULT_PREFETCH_AHEAD = 16
+
+
+class ImagePrefetcher:
+    """Read and encode the images of upcoming pages on background threads
+
+    Built with every image path a document will embed, in the order the
+    pages will place them.  Up to `ahead` of them are read and turned into
+    reportlab image objects on a thread pool while the renderer lays out and
+    encodes earlier pages, so disk (or network share) latency overlaps with
+    the rendering work; file reads, decoding and compression release the
+    GIL.  get() hands the renderer an object ready to embed and queues the
+    next path.  With an image_cache (ImageObjectCache) objects come from and
+    go into the cache.
+    """
+
+    def __init__(self, image_paths, threads=DEFAULT_PREFETCH_THREADS, ahead=DEFAULT_PREFETCH_AHEAD,
+                 image_cache=None):
+        self.image_cache = image_cache
+        self.ahead = max(1, ahead)
+        self.waits = 0
+        self._upcoming = deque(dict.fromkeys(image_paths))
+        self._loading = {}
+        self._executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='prefetch')
+        self._fill()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def get(self, image_path):
+        """Return the image object for a path, waiting for it if it is still being read
+
+        Raises whatever reading the image raised.  A path that was not
+        announced up front is read on the spot.
+        """
+        future = self._loading.pop(image_path, None)
+        if future is None:
+            self._fill()
+            return self._load(image_path)
+
+        if not future.done():
+            self.waits += 1
+            profiler.count('prefetch_waits')
+        try:
+            with profiler.stage('prefetch_wait'):
+                return future.result()
+        finally:
+            self._fill()
+
+    def close(self):
+        """Stop the threads, dropping images that were read ahead but never asked for"""
+        self._upcoming.clear()
+        for future in self._loading.values():
+            future.cancel()
+        self._loading.clear()
+        self._executor.shutdown(wait=True)
+
+    def _fill(self):
+        while self._upcoming and len(self._loading) < self.ahead:
+            image_path = self._upcoming.popleft()
+            self._loading[image_path] = self._executor.submit(self._load, image_path)
+
+    def _load(self, image_path):
+        if self.image_cache is not None:
+            return self.image_cache.get(image_path)
+        return build_image_object(image_path)
@@ -0,0 +1,140 @@
+import hashlib
+import os
+from instrumentation import profiler
+from image_object_cache import build_image_object, draw_image_object
+
+
+class ImageRegistry:
+    """Embed each card image once per document and reference it from every slot
+
+    The first time a card ID is placed its image is decoded and written into
+    the document as a Form XObject of the card at its target size.  Sizes
+    come from image_metadata (an ImageMetadataStore or a snapshot of one).  Every
+    later placement, on any page of the same canvas, only emits a reference
+    to that form.  Cards whose images resolve to the same file through
+    image_sources (deduplicated or resampled copies) share one form.  With an
+    image_cache (ImageObjectCache) the encoded image is also reused from
+    earlier documents, and with a prefetcher (ImagePrefetcher, built from
+    embed_paths()) it has already been read on a background thread.
+    """
+
+    def __init__(self, overlay_canvas, image_index, image_metadata, target_width_points, image_sources=None,
+                 image_cache=None, prefetcher=None):
+        self.canvas = overlay_canvas
+        self.image_index = image_index
+        self.image_metadata = image_metadata
+        self.target_width_points = target_width_points
+        # Optional {image_path: path_to_embed}, e.g. pre-resampled copies
+        self.image_sources = image_sources or {}
+        self.image_cache = image_cache
+        self.prefetcher = prefetcher
+        self._entries = {}
+        # (embedded file, width, height) -> form name, so cards sharing artwork share one form
+        self._forms = {}
+        self._form_count = 0
+        self._embedded_paths = set()
+
+    def __len__(self):
+        return len(self._forms)
+
+    def embed_paths(self, card_ids):
+        """Return the files embedded for the given card IDs, in order of first use
+
+        Cards whose image has no metadata (it could not be read) are skipped,
+        since register() never embeds them.
+        """
+        paths = {}
+        for card_id in card_ids:
+            image_filename = self.image_index.find(card_id) if card_id else None
+            if image_filename:
+                image_path = os.path.join(self.image_index.image_dir, image_filename)
+                if self.image_metadata.get(image_path) is not None:
+                    paths.setdefault(self.image_sources.get(image_path, image_path))
+        return list(paths)
+
+    def register(self, card_id):
+        """Embed the image for a card ID if needed and return its entry, or None if there is no image"""
+        if card_id in self._entries:
+            return self._entries[card_id]
+
+        image_filename = self.image_index.find(card_id)
+        if not image_filename:
+            return None
+        image_path = os.path.join(self.image_index.image_dir, image_filename)
+
+        metadata = self.image_metadata.get(image_path)
+        if metadata is None:
+            raise ValueError(f"{image_filename} is not a readable image")
+        aspect_ratio = metadata['height'] / metadata['width']
+        width = self.target_width_points
+        height = width * aspect_ratio
+
+        embed_path = self.image_sources.get(image_path, image_path)
+        form_key = (embed_path, width, height)
+        name = self._forms.get(form_key)
+        if name is None:
+            # Numbered apart from _forms, so a form left behind by a failed embed never has its name reused
+            name = f"card{self._form_count}"
+            self._form_count += 1
+            # Decoding and compressing the image happens here, once per distinct image
+            with profiler.stage('embed_image'):
+                # Read before the form is opened, so an unreadable image raises with nothing half-drawn
+                if embed_path in self._embedded_paths:
+                    # Already in the document at another size; drawImage reuses it
+                    image_object = None
+                elif self.prefetcher is not None:
+                    image_object = self.prefetcher.get(embed_path)
+                elif self.image_cache is not None:
+                    image_object = self.image_cache.get(embed_path)
+                else:
+                    image_object = build_image_object(embed_path)
+
+                self.canvas.beginForm(name, 0, 0, width, height)
+                try:
+                    if image_object is None:
+                        self.canvas.drawImage(embed_path, 0, 0, width=width, height=height)
+                    else:
+                        draw_image_object(self.canvas, image_object, embed_path, 0, 0, width, height)
+                finally:
+                    self.canvas.endForm()
+            self._embedded_paths.add(embed_path)
+            self._forms[form_key] = name
+            profiler.count('images_embedded')
+
+        entry = {
+            'name': name,
+            'filename': image_filename,
+            'width': width,
+            'height': height
+        }
+        self._entries[card_id] = entry
+        return entry
+
+    def place(self, card_id, x, y):
+        """Draw the card image centred on (x, y) and return its entry, or None if there is no image"""
+        entry = self.register(card_id)
+        if entry is None:
+            return None
+
+        self.canvas.saveState()
+        self.canvas.translate(x - entry['width'] / 2, y - entry['height'] / 2)
+        self.canvas.doForm(entry['name'])
+        self.canvas.restoreState()
+        return entry
+
+
+def image_stream_key(image):
+    """Return a content key for an image XObject so identical images compare equal"""
+    digest = hashlib.sha256(image._data)
+    for key in ('/Width', '/Height', '/BitsPerComponent', '/Filter', '/ColorSpace'):
+        value = image.get(key)
+        if isinstance(value, list):
+            # [/ICCBased profile]: the profile counts by its content, not by its object number in one document
+            value = [hashlib.sha256(getattr(item.get_object(), '_data', b'')).hexdigest() if hasattr(item, 'idnum')
+                     else item for item in value]
+        if value is not None and not hasattr(value, 'idnum'):
+            digest.update(f"{key}={value}".encode())
+    if '/SMask' in image:
+        digest.update(image_stream_key(image['/SMask'].get_object()).encode())
+    return digest.hexdigest()
+
@@ -0,0 +1,75 @@
+import os
+from PIL import Image
+from instrumentation import profiler
+from derived_images import save_derived_image, build_derived_images
+
+# Output resolutions offered for pre-resampling
+RESAMPLE_DPI_CHOICES = (300, 600, 800, 1200)
+
+# Modes that can be written as JPEG without losing an alpha channel or palette
+JPEG_MODES = ('RGB', 'L', 'CMYK')
+
+
+def target_pixel_size(metadata, target_width_points, dpi):
+    """Return the (width, height) in pixels a card image needs to print at the given DPI"""
+    width = round(target_width_points / 72 * dpi)
+    height = round(width * metadata['height'] / metadata['width'])
+    return width, height
+
+
+def resample_image(source_path, output_path, size, dpi):
+    """Resize an image to exactly size with a Lanczos filter and write it to output_path"""
+    with Image.open(source_path) as img:
+        resized = img.resize(size, Image.LANCZOS)
+        # Keep the colour profile, so colours are read the same way from the smaller copy
+        options = {'icc_profile': img.info['icc_profile']} if img.info.get('icc_profile') else {}
+    return save_derived_image(resized, output_path, dpi=(dpi, dpi), **options)
+
+
+class ResampleCache:
+    """Card images resized to the exact pixel size for an output DPI, cached on disk
+
+    Entries are keyed by the source file's content hash, the DPI and the
+    target pixel size, so a renamed or re-downloaded file with the same
+    content reuses its entry and an edited file gets a new one.
+    """
+
+    def __init__(self, cache_dir, dpi, metadata_store):
+        self.dpi = dpi
+        self.metadata_store = metadata_store
+        self.resample_dir = os.path.join(cache_dir, "resampled")
+        os.makedirs(self.resample_dir, exist_ok=True)
+
+    def cache_path(self, image_path, metadata, size):
+        """Return the cache file for an image resized to size"""
+        extension = '.jpg' if metadata['mode'] in JPEG_MODES else '.png'
+        content_hash = self.metadata_store.content_hash(image_path)
+        return os.path.join(self.resample_dir, f"{content_hash}_{self.dpi}dpi_{size[0]}x{size[1]}{extension}")
+
+    def prepare(self, image_paths, target_width_points, workers=1, log=print):
+        """Resample every image that needs it and return {image_path: path_to_embed}
+
+        Images already at or below the target size, and images that cannot
+        be decoded, are embedded as they are.
+        """
+        sources = {}
+        jobs = []
+        for image_path in sorted(image_paths):
+            metadata = self.metadata_store.get(image_path)
+            size = target_pixel_size(metadata, target_width_points, self.dpi)
+            if metadata['width'] <= size[0]:
+                sources[image_path] = image_path
+                continue
+
+            output_path = self.cache_path(image_path, metadata, size)
+            sources[image_path] = output_path
+            if not os.path.exists(output_path):
+                jobs.append((image_path, output_path, size, self.dpi))
+
+        profiler.count('images_resampled', len(jobs))
+        log(f"Resampling to {self.dpi} DPI: {len(jobs)} to resize, "
+            f"{len(sources) - len(jobs)} cached or already small enough")
+
+        for image_path in build_derived_images(resample_image, jobs, workers, log):
+            sources[image_path] = image_path
+        return sources
@@ -0,0 +1,160 @@
+import cProfile
+import json
+import os
+import resource
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+# Returned by stage() while profiling is off
+_NULL_STAGE = nullcontext()
+
+
+def _children_cpu():
+    """Return the CPU seconds used by finished child processes (workers, Ghostscript)"""
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+class Instrumentation:
+    """Per-stage wall and CPU time, counters and optional cProfile/tracemalloc data for one run
+
+    Stages nest and may repeat; every stage path ("render/embed_image")
+    accumulates its calls, wall time, CPU time of this process and of child
+    processes that finished during it, and with tracemalloc the peak traced
+    memory.  While disabled, stage() hands back a shared null context and
+    count() returns at once, so instrumented code costs next to nothing.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.stages = {}
+        self.counters = {}
+        self._stack = []
+        self._cprofile = None
+        self._started = None
+
+    def enable(self, use_cprofile=False, use_tracemalloc=False):
+        """Start recording, optionally with cProfile and tracemalloc running"""
+        self.enabled = True
+        self._started = (time.perf_counter(), time.process_time())
+        if use_tracemalloc and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        if use_cprofile and self._cprofile is None:
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+
+    def stage(self, name):
+        """Return a context manager timing one pass through a stage"""
+        if not self.enabled:
+            return _NULL_STAGE
+        return self._timed_stage(name)
+
+    @contextmanager
+    def _timed_stage(self, name):
+        tracing = tracemalloc.is_tracing()
+        if tracing and self._stack:
+            # Resetting the peak for this stage must not lose the enclosing stage's peak so far
+            self._stack[-1][1] = max(self._stack[-1][1], tracemalloc.get_traced_memory()[1])
+        if tracing:
+            tracemalloc.reset_peak()
+
+        path = '/'.join([entry[0] for entry in self._stack] + [name])
+        # Created on entry so the summary lists stages in the order they start
+        record = self.stages.setdefault(path, {'calls': 0, 'wall': 0.0, 'cpu': 0.0, 'children_cpu': 0.0,
+                                               'peak_bytes': None})
+        entry = [name, 0]
+        self._stack.append(entry)
+        wall, cpu, children_cpu = time.perf_counter(), time.process_time(), _children_cpu()
+        try:
+            yield
+        finally:
+            self._stack.pop()
+            peak = max(entry[1], tracemalloc.get_traced_memory()[1]) if tracing else None
+            if tracing and self._stack:
+                self._stack[-1][1] = max(self._stack[-1][1], peak)
+
+            record['calls'] += 1
+            record['wall'] += time.perf_counter() - wall
+            record['cpu'] += time.process_time() - cpu
+            record['children_cpu'] += _children_cpu() - children_cpu
+            if peak is not None:
+                record['peak_bytes'] = max(record['peak_bytes'] or 0, peak)
+
+    def count(self, name, amount=1):
+        """Add to a named counter"""
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def count_file(self, path):
+        """Count a file just written and its size"""
+        if self.enabled and os.path.exists(path):
+            self.count('files_written')
+            self.count('bytes_written', os.path.getsize(path))
+
+    def collect(self):
+        """Return and clear the stages and counters recorded so far, e.g. to send back from a worker"""
+        collected = {'stages': self.stages, 'counters': self.counters}
+        self.stages = {}
+        self.counters = {}
+        return collected
+
+    def merge(self, collected):
+        """Add stages and counters collected in another process"""
+        if not self.enabled or not collected:
+            return
+        for path, other in collected['stages'].items():
+            record = self.stages.setdefault(path, {'calls': 0, 'wall': 0.0, 'cpu': 0.0, 'children_cpu': 0.0,
+                                                   'peak_bytes': None})
+            for key in ('calls', 'wall', 'cpu', 'children_cpu'):
+                record[key] += other[key]
+            if other['peak_bytes'] is not None:
+                record['peak_bytes'] = max(record['peak_bytes'] or 0, other['peak_bytes'])
+        for name, amount in collected['counters'].items():
+            self.count(name, amount)
+
+    def report(self, jsonl_path=None, cprofile_path=None, tracemalloc_path=None):
+        """Print the summary table and write the JSON lines, cProfile and tracemalloc dumps"""
+        if not self.enabled:
+            return
+        total_wall = time.perf_counter() - self._started[0]
+        total_cpu = time.process_time() - self._started[1]
+
+        print(f"\n{'Stage':<34} {'Calls':>6} {'Wall s':>9} {'CPU s':>9} {'Child CPU s':>12} {'Peak MiB':>9}")
+        for path, record in self.stages.items():
+            depth = path.count('/')
+            label = "  " * depth + path.rsplit('/', 1)[-1]
+            peak = f"{record['peak_bytes'] / 1048576:.1f}" if record['peak_bytes'] is not None else "-"
+            print(f"{label:<34} {record['calls']:>6} {record['wall']:>9.3f} {record['cpu']:>9.3f} "
+                  f"{record['children_cpu']:>12.3f} {peak:>9}")
+        print(f"{'total':<34} {'':>6} {total_wall:>9.3f} {total_cpu:>9.3f}")
+
+        if self.counters:
+            print()
+            for name, amount in sorted(self.counters.items()):
+                print(f"{name:<34} {amount:>15,}")
+
+        if jsonl_path:
+            with open(jsonl_path, 'w') as f:
+                for path, record in self.stages.items():
+                    f.write(json.dumps({'type': 'stage', 'stage': path, **record}) + "\n")
+                for name, amount in sorted(self.counters.items()):
+                    f.write(json.dumps({'type': 'counter', 'name': name, 'value': amount}) + "\n")
+                f.write(json.dumps({'type': 'total', 'wall': total_wall, 'cpu': total_cpu}) + "\n")
+            print(f"\nProfile written: {jsonl_path}")
+
+        if self._cprofile is not None and cprofile_path:
+            self._cprofile.disable()
+            self._cprofile.dump_stats(cprofile_path)
+            print(f"cProfile stats written: {cprofile_path} (view with python -m pstats)")
+
+        if tracemalloc.is_tracing() and tracemalloc_path:
+            top_stats = tracemalloc.take_snapshot().statistics('lineno')
+            with open(tracemalloc_path, 'w') as f:
+                for stat in top_stats[:50]:
+                    f.write(f"{stat}\n")
+            print(f"tracemalloc top allocations written: {tracemalloc_path}")
+
+
+# Shared instance the scripts and modules record into
+profiler = Instrumentation()
@@ -0,0 +1,92 @@
+from color_management import ICCImageXObject, attach_profile
+
+# Start-of-image marker every JPEG file begins with
+JPEG_SIGNATURE = b'\xff\xd8'
+
+# Start-of-frame markers PDF's DCTDecode filter takes as is: baseline, extended sequential and progressive
+DCT_FRAME_MARKERS = {0xC0, 0xC1, 0xC2}
+
+# Markers that stand alone, without a length field
+STANDALONE_MARKERS = {0x01, 0xD0, 0xD1, 0xD2, 0xD3, 0xD4, 0xD5, 0xD6, 0xD7}
+
+# Colour space for each number of JPEG components
+JPEG_COLOR_SPACES = {1: 'DeviceGray', 3: 'DeviceRGB', 4: 'DeviceCMYK'}
+
+
+def read_jpeg_header(data):
+    """Return (width, height, components, adobe, icc_profile) from a JPEG's markers, or None if it must be decoded
+
+    data is the file's bytes; only the markers up to the frame header are
+    read.  adobe tells whether an Adobe APP14 segment is
+    present, which marks CMYK data as stored inverted; icc_profile is the
+    profile from the APP2 segments, or None.  Lossless, hierarchical and
+    arithmetic-coded JPEGs, 12-bit samples and frames without a height are
+    refused.
+    """
+    if data[:2] != JPEG_SIGNATURE:
+        return None
+    adobe = False
+    icc_chunks = {}
+    position = 2
+    while position + 4 <= len(data):
+        if data[position] != 0xFF:
+            return None
+        marker = data[position + 1]
+        if marker == 0xFF:
+            # Fill byte before a marker
+            position += 1
+            continue
+        if marker in STANDALONE_MARKERS:
+            position += 2
+            continue
+
+        length = int.from_bytes(data[position + 2:position + 4], 'big')
+        if marker == 0xEE and data[position + 4:position + 9] == b'Adobe':
+            adobe = True
+        elif marker == 0xE2 and data[position + 4:position + 16] == b'ICC_PROFILE\0':
+            # A profile may be split over several segments, numbered from 1
+            icc_chunks[data[position + 16]] = data[position + 18:position + 2 + length]
+        elif marker in DCT_FRAME_MARKERS:
+            precision = data[position + 4]
+            height = int.from_bytes(data[position + 5:position + 7], 'big')
+            width = int.from_bytes(data[position + 7:position + 9], 'big')
+            components = data[position + 9]
+            if precision != 8 or not width or not height or components not in JPEG_COLOR_SPACES:
+                return None
+            icc_profile = b''.join(icc_chunks[number] for number in sorted(icc_chunks)) if icc_chunks else None
+            return width, height, components, adobe, icc_profile
+        elif 0xC3 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC) or marker in (0xD9, 0xDA):
+            # Another kind of frame, or image data before any frame header
+            return None
+        position += 2 + length
+    return None
+
+def build_jpeg_object(name, image_path):
+    """Return a reportlab image object embedding a JPEG file's bytes as they are, or None if it must be decoded
+
+    Other formats are turned away by their first two bytes.  A JPEG is read
+    once and its bytes go into the PDF as a DCTDecode stream: no decoding,
+    no re-encoding and none of reportlab's ASCII85 text encoding, so there
+    is no generation loss and almost no CPU time.  An embedded ICC profile
+    goes with them.
+    """
+    with open(image_path, 'rb') as f:
+        if f.read(2) != JPEG_SIGNATURE:
+            return None
+        f.seek(0)
+        stream_content = f.read()
+    header = read_jpeg_header(stream_content)
+    if header is None:
+        return None
+
+    width, height, components, adobe, icc_profile = header
+    image_object = ICCImageXObject(name)
+    image_object.width = width
+    image_object.height = height
+    image_object.bitsPerComponent = 8
+    image_object.colorSpace = JPEG_COLOR_SPACES[components]
+    # Adobe applications write CMYK JPEGs inverted; format() then adds the matching /Decode array
+    image_object._dotrans = int(components == 4 and adobe)
+    image_object._filters = ('DCTDecode',)
+    image_object.streamContent = stream_content
+    return attach_profile(image_object, icc_profile)
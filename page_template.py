@@ -0,0 +1,70 @@
+from PyPDF2 import PdfReader, PdfWriter
+from PyPDF2.generic import (ArrayObject, DecodedStreamObject, DictionaryObject, FloatObject,
+                            NameObject)
+
+# Resource name the template form is registered under on every page
+TEMPLATE_XOBJECT_NAME = '/CutTemplate'
+
+
+class PageTemplate:
+    """A template PDF page parsed once and stamped beneath output pages as a shared Form XObject
+
+    Merging the template page with PyPDF2 for every sheet either piles earlier
+    sheets' content onto the shared page object or means parsing the template
+    file again each time.  Here the template's content stream and resources
+    become a single form, and stamping a page only adds a reference to it, so
+    every writer stores the template once and each page stays the same size.
+    """
+
+    def __init__(self, template_pdf, page_index=0):
+        self._reader = PdfReader(template_pdf)
+        page = self._reader.pages[page_index]
+        self.mediabox = [float(value) for value in page.mediabox]
+
+        contents = page.get_contents()
+        if contents is None:
+            content_data = b""
+        elif isinstance(contents, ArrayObject):
+            content_data = b"\n".join(stream.get_object().get_data() for stream in contents)
+        else:
+            content_data = contents.get_data()
+
+        form = DecodedStreamObject()
+        form.set_data(content_data)
+        form.update({
+            NameObject('/Type'): NameObject('/XObject'),
+            NameObject('/Subtype'): NameObject('/Form'),
+            NameObject('/BBox'): ArrayObject(FloatObject(value) for value in self.mediabox),
+            NameObject('/Resources'): page.raw_get('/Resources') if '/Resources' in page else DictionaryObject()
+        })
+
+        prefix = DecodedStreamObject()
+        prefix.set_data(f"q {TEMPLATE_XOBJECT_NAME} Do Q\n".encode())
+
+        # The holder owns the shared objects; writers clone each of them once
+        self._holder = PdfWriter()
+        self.form_reference = self._holder._add_object(form)
+        self.prefix_reference = self._holder._add_object(prefix)
+
+    def stamp(self, page):
+        """Draw the template beneath the page's own content and return the page"""
+        resources = page.get('/Resources')
+        if resources is None:
+            resources = DictionaryObject()
+            page[NameObject('/Resources')] = resources
+        resources = resources.get_object()
+
+        xobjects = resources.get('/XObject')
+        if xobjects is None:
+            xobjects = DictionaryObject()
+            resources[NameObject('/XObject')] = xobjects
+        xobjects.get_object()[NameObject(TEMPLATE_XOBJECT_NAME)] = self.form_reference
+
+        contents = page.raw_get('/Contents') if '/Contents' in page else None
+        if contents is None:
+            page[NameObject('/Contents')] = ArrayObject([self.prefix_reference])
+        elif isinstance(contents.get_object(), ArrayObject):
+            page[NameObject('/Contents')] = ArrayObject([self.prefix_reference] + list(contents.get_object()))
+        else:
+            page[NameObject('/Contents')] = ArrayObject([self.prefix_reference, contents])
+        return page
@@ -0,0 +1,138 @@
+import hashlib
+import weakref
+from PyPDF2.generic import (ArrayObject, DecodedStreamObject, DictionaryObject, EncodedStreamObject,
+                            IndirectObject, NameObject, NumberObject, StreamObject)
+from image_registry import image_stream_key
+
+# Object numbers reserved for the page tree root and the catalog, written when the file is closed
+PAGES_OBJECT = 1
+CATALOG_OBJECT = 2
+
+
+class PdfStreamWriter:
+    """Write a PDF one page at a time, sending every object to the file as soon as it is copied
+
+    PyPDF2's PdfWriter keeps every page and image in memory until write(),
+    so assembling a large job held the whole output (and the readers it came
+    from) at once.  Here a page's objects are copied out and written
+    straight away; only their file offsets are kept, and each source
+    document can be released once its pages are added.  Objects shared
+    between pages of one source (such as a template form) are written once,
+    and identical images and ICC profiles from any source are stored once.
+    """
+
+    def __init__(self, output_path):
+        self.output_path = output_path
+        self._file = open(output_path, 'wb')
+        self._file.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+        self._offsets = {}
+        self._next_number = CATALOG_OBJECT + 1
+        self._page_numbers = []
+        # (weak reference to the source document, source object number) -> output object number
+        self._copied = {}
+        self._prune_at = 4096
+        # Image or ICC profile content key -> output object number
+        self._images = {}
+        self._pending = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self._file.close()
+
+    def __len__(self):
+        return len(self._page_numbers)
+
+    def add_page(self, page):
+        """Copy a page and everything it uses into the file"""
+        page_dict = self._copy(page, skip_keys=('/Parent',))
+        page_dict[NameObject('/Parent')] = IndirectObject(PAGES_OBJECT, 0, None)
+        page_number = self._allocate()
+        self._write(page_number, page_dict)
+        self._page_numbers.append(page_number)
+
+        while self._pending:
+            number, source = self._pending.pop()
+            self._write(number, self._copy(source))
+
+        # Entries for sources that have since been released can never match again
+        if len(self._copied) > self._prune_at:
+            self._copied = {key: number for key, number in self._copied.items() if key[0]() is not None}
+            self._prune_at = max(4096, 2 * len(self._copied))
+
+    def close(self):
+        """Write the page tree, catalog and cross-reference table and close the file"""
+        self._write(PAGES_OBJECT, DictionaryObject({
+            NameObject('/Type'): NameObject('/Pages'),
+            NameObject('/Kids'): ArrayObject(IndirectObject(number, 0, None) for number in self._page_numbers),
+            NameObject('/Count'): NumberObject(len(self._page_numbers))
+        }))
+        self._write(CATALOG_OBJECT, DictionaryObject({
+            NameObject('/Type'): NameObject('/Catalog'),
+            NameObject('/Pages'): IndirectObject(PAGES_OBJECT, 0, None)
+        }))
+
+        xref_offset = self._file.tell()
+        self._file.write(f"xref\n0 {self._next_number}\n0000000000 65535 f \n".encode())
+        for number in range(1, self._next_number):
+            self._file.write(f"{self._offsets[number]:010d} 00000 n \n".encode())
+        self._file.write(f"trailer\n<< /Size {self._next_number} /Root {CATALOG_OBJECT} 0 R >>\n"
+                         f"startxref\n{xref_offset}\n%%EOF\n".encode())
+        self._file.close()
+
+    def _allocate(self):
+        number = self._next_number
+        self._next_number += 1
+        return number
+
+    def _write(self, number, obj):
+        self._offsets[number] = self._file.tell()
+        self._file.write(f"{number} 0 obj\n".encode())
+        obj.write_to_stream(self._file, None)
+        self._file.write(b"\nendobj\n")
+
+    def _reference(self, reference):
+        """Return the output reference for a source reference, queueing the object to be written if new"""
+        source_key = (weakref.ref(reference.pdf), reference.idnum)
+        number = self._copied.get(source_key)
+        if number is None:
+            source = reference.get_object()
+            content_key = None
+            if isinstance(source, StreamObject) and source.get('/Subtype') == '/Image':
+                content_key = image_stream_key(source)
+            elif isinstance(source, StreamObject) and '/N' in source and '/Type' not in source:
+                content_key = "icc:" + hashlib.sha256(source._data).hexdigest()
+            if content_key is not None:
+                number = self._images.get(content_key)
+            if number is None:
+                number = self._allocate()
+                self._pending.append((number, source))
+                if content_key is not None:
+                    self._images[content_key] = number
+            self._copied[source_key] = number
+        return IndirectObject(number, 0, None)
+
+    def _copy(self, obj, skip_keys=()):
+        """Return a copy of a direct object with its references renumbered for the output file"""
+        if isinstance(obj, IndirectObject):
+            return self._reference(obj)
+        if isinstance(obj, StreamObject):
+            copied = DecodedStreamObject() if isinstance(obj, DecodedStreamObject) else EncodedStreamObject()
+            copied._data = obj._data
+            # The length is written from the data; an indirect /Length would only add an unused object
+            skip_keys = tuple(skip_keys) + ('/Length',)
+        elif isinstance(obj, DictionaryObject):
+            copied = DictionaryObject()
+        elif isinstance(obj, ArrayObject):
+            return ArrayObject(self._copy(item) for item in obj)
+        else:
+            return obj
+
+        for key, value in obj.items():
+            if key not in skip_keys:
+                copied[NameObject(key)] = self._copy(value)
+        return copied
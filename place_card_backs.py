@@ -1,14 +1,29 @@
-from reportlab.lib.pagesizes import letter, landscape
 from reportlab.pdfgen import canvas
 from reportlab.lib.units import mm
-from PIL import Image
+from image_metadata import ImageMetadataStore
+from sheet_layout import get_layout, MM
+from instrumentation import profiler
+import argparse
 import os
 from PyPDF2 import PdfReader, PdfWriter
 from reportlab.pdfgen import canvas
 from io import BytesIO
 
-# Set up page size (landscape 8.5x11 inches)
-page_width, page_height = landscape(letter)
+# Command line options
+parser = argparse.ArgumentParser(description="Place the card back at every point of the cut line template")
+parser.add_argument('--profile', action='store_true',
+                    help="time each stage, count bytes written, print a summary table and write output/profile_backs.jsonl")
+parser.add_argument('--profile-cprofile', action='store_true',
+                    help="with --profile, also run cProfile and write output/profile_backs.pstats")
+parser.add_argument('--profile-tracemalloc', action='store_true',
+                    help="with --profile, also track peak Python memory per stage")
+args = parser.parse_args()
+if args.profile or args.profile_cprofile or args.profile_tracemalloc:
+    profiler.enable(args.profile_cprofile, args.profile_tracemalloc)
+
+# Sheet layout the template was drawn for (landscape 8.5x11 inches)
+layout = get_layout()
+page_width, page_height = layout.page_size
 
 # Input template PDF and output filename
 template_pdf = "template_cut_lines.pdf"
@@ -24,17 +39,8 @@ if not os.path.exists(template_pdf):
     print("Please run the original script first to generate the template.")
     exit(1)
 
-# Define points with their coordinates (same as original)
-points = [
-    ("A", 102.614358, 456.2361258),
-    ("B", 298.204786, 456.2361258),
-    ("C", 493.795214, 456.2361258),
-    ("D", 689.385642, 456.2361258),
-    ("E", 102.614358, 155.7638742),
-    ("F", 298.204786, 155.7638742),
-    ("G", 493.795214, 155.7638742),
-    ("H", 689.385642, 155.7638742)
-]
+# Card centre points (same as the template)
+points = layout.points
 
 # Card back image processing
 card_back_path = "./assets/backs/1954.jpg"
@@ -45,34 +51,35 @@ overlay_canvas = canvas.Canvas(packet, pagesize=(page_width, page_height))
 
 if os.path.exists(card_back_path):
     try:
-        # Open and process the image
-        img = Image.open(card_back_path)
+        # Read the image size from its header (cached between runs)
+        with profiler.stage('image_metadata'), ImageMetadataStore() as metadata_store:
+            img = metadata_store.get(card_back_path)
         
-        # Target width in mm and convert to points (1 mm = 72/25.4 points)
-        target_width_mm = 69.35
-        target_width_points = target_width_mm * 72 / 25.4
+        # Images are drawn at the layout's card size plus bleed, in points
+        target_width_points = layout.image_width
         
         # Calculate the aspect ratio to maintain proportions
-        aspect_ratio = img.height / img.width
+        aspect_ratio = img['height'] / img['width']
         target_height_points = target_width_points * aspect_ratio
         
-        print(f"Original image size: {img.width} x {img.height}")
+        print(f"Original image size: {img['width']} x {img['height']}")
         print(f"Target size in points: {target_width_points:.2f} x {target_height_points:.2f}")
-        print(f"Target size in mm: {target_width_mm} x {target_width_mm * aspect_ratio:.2f}")
+        print(f"Target size in mm: {target_width_points / MM:.2f} x {target_height_points / MM:.2f}")
         
         # Place card back at each point (centered on the point)
-        for label, x, y in points:
-            # Calculate position to center the image on the point
-            img_x = x - (target_width_points / 2)
-            img_y = y - (target_height_points / 2)
-            
-            # Draw the image on the overlay canvas
-            overlay_canvas.drawImage(card_back_path, 
-                                   img_x, img_y, 
-                                   width=target_width_points, 
-                                   height=target_height_points)
-            
-            print(f"Placed card back at point {label}: center ({x}, {y}), image at ({img_x:.2f}, {img_y:.2f})")
+        with profiler.stage('draw_backs'):
+            for label, x, y in points:
+                # Calculate position to center the image on the point
+                img_x = x - (target_width_points / 2)
+                img_y = y - (target_height_points / 2)
+                
+                # Draw the image on the overlay canvas
+                overlay_canvas.drawImage(card_back_path, 
+                                       img_x, img_y, 
+                                       width=target_width_points, 
+                                       height=target_height_points)
+                
+                print(f"Placed card back at point {label}: center ({x}, {y}), image at ({img_x:.2f}, {img_y:.2f})")
     
     except Exception as e:
         print(f"Error processing image: {e}")
@@ -83,28 +90,36 @@ else:
     print("No card backs will be added to the template.")
 
 # Save the overlay canvas
-overlay_canvas.save()
+with profiler.stage('encode_pdf'):
+    overlay_canvas.save()
 packet.seek(0)
 
-# Read the template PDF
-template_reader = PdfReader(template_pdf)
-overlay_reader = PdfReader(packet)
-
-# Create output PDF writer
-output_writer = PdfWriter()
-
-# Merge the template with the overlay
-template_page = template_reader.pages[0]
-if len(overlay_reader.pages) > 0:
-    overlay_page = overlay_reader.pages[0]
-    template_page.merge_page(overlay_page)
-
-# Add the merged page to output
-output_writer.add_page(template_page)
+with profiler.stage('merge_template'):
+    # Read the template PDF
+    template_reader = PdfReader(template_pdf)
+    overlay_reader = PdfReader(packet)
+    
+    # Create output PDF writer
+    output_writer = PdfWriter()
+    
+    # Merge the template with the overlay
+    template_page = template_reader.pages[0]
+    if len(overlay_reader.pages) > 0:
+        overlay_page = overlay_reader.pages[0]
+        template_page.merge_page(overlay_page)
+    
+    # Add the merged page to output
+    output_writer.add_page(template_page)
 
 # Write the final PDF
-with open(output_filename, 'wb') as output_file:
-    output_writer.write(output_file)
+with profiler.stage('write'):
+    with open(output_filename, 'wb') as output_file:
+        output_writer.write(output_file)
+profiler.count_file(output_filename)
 
 print(f"PDF generated: {output_filename}")
-print(f"Template '{template_pdf}' used as base with card backs overlaid.")
\ No newline at end of file
+print(f"Template '{template_pdf}' used as base with card backs overlaid.")
+
+profiler.report(os.path.join(output_dir, "profile_backs.jsonl"),
+                os.path.join(output_dir, "profile_backs.pstats"),
+                os.path.join(output_dir, "profile_backs_tracemalloc.txt"))
\ No newline at end of file
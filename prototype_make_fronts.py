@@ -1,14 +1,15 @@
-from reportlab.lib.pagesizes import letter, landscape
 from reportlab.pdfgen import canvas
 from reportlab.lib.units import mm
-from PIL import Image
+from image_metadata import ImageMetadataStore
+from sheet_layout import get_layout, MM
 import os
 from PyPDF2 import PdfReader, PdfWriter
 from reportlab.pdfgen import canvas
 from io import BytesIO
 
-# Set up page size (landscape 8.5x11 inches)
-page_width, page_height = landscape(letter)
+# Sheet layout the template was drawn for (landscape 8.5x11 inches)
+layout = get_layout()
+page_width, page_height = layout.page_size
 
 # Input template PDF and output filename
 template_pdf = "template_cut_lines.pdf"
@@ -24,17 +25,8 @@ if not os.path.exists(template_pdf):
     print("Please run the original script first to generate the template.")
     exit(1)
 
-# Define points with their coordinates (same as original)
-points = [
-    ("A", 102.614358, 456.2361258),
-    ("B", 298.204786, 456.2361258),
-    ("C", 493.795214, 456.2361258),
-    ("D", 689.385642, 456.2361258),
-    ("E", 102.614358, 155.7638742),
-    ("F", 298.204786, 155.7638742),
-    ("G", 493.795214, 155.7638742),
-    ("H", 689.385642, 155.7638742)
-]
+# Card centre points (same as the template)
+points = layout.points
 
 # Directory containing front images
 fronts_dir = "./assets/fronts"
@@ -57,25 +49,28 @@ else:
     print(f"Directory not found: {fronts_dir}")
     exit(1)
 
-# Check if we have exactly 8 images
-if len(front_images) != 8:
-    print(f"Warning: Found {len(front_images)} images, but expected 8.")
+# Check if we have exactly one image per slot on the sheet
+cards_per_page = layout.cards_per_page
+if len(front_images) != cards_per_page:
+    print(f"Warning: Found {len(front_images)} images, but expected {cards_per_page}.")
     if len(front_images) == 0:
         print("No images found. Exiting.")
         exit(1)
-    elif len(front_images) < 8:
+    elif len(front_images) < cards_per_page:
         print(f"Will use the available {len(front_images)} images.")
     else:
-        print("Will use the first 8 images.")
-        front_images = front_images[:8]
+        print(f"Will use the first {cards_per_page} images.")
+        front_images = front_images[:cards_per_page]
 
 # Create a new canvas in memory to draw the card fronts
 packet = BytesIO()
 overlay_canvas = canvas.Canvas(packet, pagesize=(page_width, page_height))
 
-# Target width in mm and convert to points (1 mm = 72/25.4 points)
-target_width_mm = 69.35
-target_width_points = target_width_mm * 72 / 25.4
+# Images are drawn at the layout's card size plus bleed, in points
+target_width_points = layout.image_width
+
+# Image sizes come from the header metadata cache
+metadata_store = ImageMetadataStore()
 
 # Process each image and place it at corresponding point
 for i, (label, x, y) in enumerate(points):
@@ -83,17 +78,17 @@ for i, (label, x, y) in enumerate(points):
         image_path = front_images[i]
         
         try:
-            # Open and process the image
-            img = Image.open(image_path)
+            # Read the image size from its header (cached between runs)
+            img = metadata_store.get(image_path)
             
             # Calculate the aspect ratio to maintain proportions
-            aspect_ratio = img.height / img.width
+            aspect_ratio = img['height'] / img['width']
             target_height_points = target_width_points * aspect_ratio
             
             print(f"Processing {os.path.basename(image_path)}:")
-            print(f"  Original size: {img.width} x {img.height}")
+            print(f"  Original size: {img['width']} x {img['height']}")
             print(f"  Target size in points: {target_width_points:.2f} x {target_height_points:.2f}")
-            print(f"  Target size in mm: {target_width_mm} x {target_width_mm * aspect_ratio:.2f}")
+            print(f"  Target size in mm: {target_width_points / MM:.2f} x {target_height_points / MM:.2f}")
             
             # Calculate position to center the image on the point
             img_x = x - (target_width_points / 2)
@@ -113,6 +108,8 @@ for i, (label, x, y) in enumerate(points):
     else:
         print(f"No image available for point {label}")
 
+metadata_store.close()
+
 # Save the overlay canvas
 overlay_canvas.save()
 packet.seek(0)
@@ -139,4 +136,4 @@ with open(output_filename, 'wb') as output_file:
 
 print(f"\nPDF generated: {output_filename}")
 print(f"Template '{template_pdf}' used as base with card fronts overlaid.")
-print(f"Processed {min(len(front_images), 8)} images from {fronts_dir}")
\ No newline at end of file
+print(f"Processed {min(len(front_images), cards_per_page)} images from {fronts_dir}")
\ No newline at end of file
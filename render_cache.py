@@ -0,0 +1,40 @@
+import hashlib
+import json
+import os
+
+
+class RenderCache:
+    """Finished page PDFs stored under a hash of everything that affects how they look
+
+    A page's key covers its slot card IDs, the contents of the images in those
+    slots and the layout/output settings, so a page is only rendered again when
+    one of those changes.  Keys never go stale; a changed page simply gets a
+    new key.
+    """
+
+    def __init__(self, cache_dir):
+        self.pages_dir = os.path.join(cache_dir, "pages")
+        os.makedirs(self.pages_dir, exist_ok=True)
+
+    def page_key(self, page_card_ids, image_hashes, settings):
+        """Return the cache key for a page
+
+        image_hashes maps card IDs to the content hash of their image and
+        settings is any JSON-serialisable description of layout and output
+        options.
+        """
+        description = {
+            'slots': list(page_card_ids),
+            'images': [image_hashes.get(card_id) for card_id in page_card_ids],
+            'settings': settings
+        }
+        encoded = json.dumps(description, sort_keys=True, separators=(',', ':'))
+        return hashlib.sha256(encoded.encode()).hexdigest()
+
+    def path(self, key):
+        """Return the path of the cached PDF for a key"""
+        return os.path.join(self.pages_dir, f"{key}.pdf")
+
+    def has(self, key):
+        """Return True if a finished page is stored for the key"""
+        return os.path.exists(self.path(key))
@@ -0,0 +1,236 @@
+import argparse
+import json
+import os
+import tempfile
+import time
+import traceback
+import xml.etree.ElementTree as ET
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from io import BytesIO
+from urllib.parse import urlsplit, parse_qs
+
+from cards_xml import read_order
+from image_index import ImageIndex
+from image_metadata import ImageMetadataStore, DEFAULT_CACHE_DIR
+from image_resample import ResampleCache, RESAMPLE_DPI_CHOICES
+from image_object_cache import ImageObjectCache, DEFAULT_CACHE_MB
+from cut_guides import GUIDE_STYLES
+from sheet_layout import LAYOUTS, DEFAULT_LAYOUT, get_layout
+from xml_make_fronts import (check_and_install_ghostscript, check_images_exist, create_slot_table,
+                             create_overlay_document, compress_pdf)
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+
+class RenderService:
+    """Warm state shared by every render job: the image index, image metadata and encoded images
+
+    The fronts directory is only listed again when its modification time
+    changes, image sizes stay in the open metadata store and every image's
+    encoded form stays in an ImageObjectCache, so a repeat job only lays out
+    pages and writes the PDF.
+    """
+
+    def __init__(self, fronts_dir, cache_dir=DEFAULT_CACHE_DIR, cache_mb=DEFAULT_CACHE_MB, resample_dpi=None,
+                 compress=True, verbose=False):
+        self.fronts_dir = fronts_dir
+        self.metadata_store = ImageMetadataStore(cache_dir)
+        self.image_cache = ImageObjectCache(cache_mb * 1024 * 1024)
+        self.resample_cache = ResampleCache(cache_dir, resample_dpi, self.metadata_store) if resample_dpi else None
+        self.has_ghostscript = compress and check_and_install_ghostscript()
+        self.verbose = verbose
+        self.jobs = 0
+        self.started = time.time()
+        self._image_index = None
+        self._index_mtime = None
+
+    def image_index(self):
+        """Return the index of the fronts directory, listing it again only if files were added or removed"""
+        mtime = os.stat(self.fronts_dir).st_mtime_ns
+        if self._image_index is None or mtime != self._index_mtime:
+            self._image_index = ImageIndex(self.fronts_dir)
+            self._index_mtime = mtime
+            print(f"Indexed {len(self._image_index)} images in {self.fronts_dir}")
+        return self._image_index
+
+    def render(self, xml_data, layout_name=DEFAULT_LAYOUT, guide_style='template', x_offset_cm=0.0, compress=True):
+        """Render the fronts for a cards.xml document and return the PDF bytes
+
+        Raises ValueError describing the problem if the order cannot be rendered.
+        """
+        start = time.perf_counter()
+        if layout_name not in LAYOUTS:
+            raise ValueError(f"Unknown layout '{layout_name}' (choose from {', '.join(LAYOUTS)})")
+        if guide_style not in GUIDE_STYLES:
+            raise ValueError(f"Unknown guides '{guide_style}' (choose from {', '.join(GUIDE_STYLES)})")
+        layout = get_layout(layout_name)
+
+        try:
+            order = read_order(BytesIO(xml_data))
+        except ET.ParseError as e:
+            raise ValueError(f"Invalid XML: {e}")
+        if order['problems']:
+            raise ValueError("Invalid slot assignments in XML:\n" + "\n".join(order['problems']))
+
+        slot_table = create_slot_table(order['fronts'])
+        if slot_table.collisions:
+            raise ValueError("Slots claimed by more than one card:\n" + "\n".join(
+                f"Slot {slot}: {first_id} and {second_id}" for slot, first_id, second_id in slot_table.collisions))
+
+        image_index = self.image_index()
+        missing_images, existing_images = check_images_exist(slot_table, image_index)
+        if missing_images:
+            raise ValueError("Missing images for card IDs:\n" + "\n".join(
+                f"Slot {slot}: {card_id}" for slot, card_id in missing_images))
+
+        log_lines = []
+        image_paths = {image_index.path(card_id) for card_id in slot_table.card_ids}
+        image_metadata = self.metadata_store.snapshot(image_paths)
+        for image_path, error in sorted(self.metadata_store.unreadable.items()):
+            log_lines.append(f"  Warning: Cannot read image {os.path.basename(image_path)}: {error}")
+        image_paths = set(image_metadata)
+        image_sources = None
+        if self.resample_cache:
+            image_sources = self.resample_cache.prepare(image_paths, layout.image_width, log=log_lines.append)
+        self.metadata_store.commit()
+
+        total_pages = slot_table.page_count(layout.cards_per_page)
+        packet = create_overlay_document(slot_table, range(total_pages), layout, image_index, image_metadata,
+                                         image_sources, guide_style, x_offset_cm * 10 * 72 / 25.4,
+                                         log_lines.append, self.image_cache)
+        pdf_data = packet.getvalue()
+
+        if compress and self.has_ghostscript:
+            with tempfile.TemporaryDirectory() as temp_dir:
+                uncompressed_pdf = os.path.join(temp_dir, "fronts_uncompressed.pdf")
+                compressed_pdf = os.path.join(temp_dir, "fronts.pdf")
+                with open(uncompressed_pdf, 'wb') as output_file:
+                    output_file.write(pdf_data)
+                if compress_pdf(uncompressed_pdf, compressed_pdf):
+                    with open(compressed_pdf, 'rb') as f:
+                        pdf_data = f.read()
+
+        self.jobs += 1
+        if self.verbose:
+            for line in log_lines:
+                print(line)
+        cache_stats = self.image_cache.stats()
+        print(f"Job {self.jobs}: {total_pages} pages, {len(slot_table)} slots, {len(pdf_data) // 1024} KiB "
+              f"in {time.perf_counter() - start:.2f}s (image cache {cache_stats['hits']} hits, "
+              f"{cache_stats['misses']} misses)")
+        return pdf_data
+
+    def status(self):
+        """Return a JSON-serialisable description of the service and its caches"""
+        return {
+            'fronts_dir': self.fronts_dir,
+            'indexed_images': len(self._image_index) if self._image_index is not None else None,
+            'image_cache': self.image_cache.stats(),
+            'compress': self.has_ghostscript,
+            'resample_dpi': self.resample_cache.dpi if self.resample_cache else None,
+            'jobs': self.jobs,
+            'uptime_seconds': round(time.time() - self.started, 1)
+        }
+
+    def close(self):
+        """Write cached metadata to disk"""
+        self.metadata_store.close()
+
+
+class RenderRequestHandler(BaseHTTPRequestHandler):
+    """HTTP front end: POST /render with cards.xml as the body, GET /status for cache statistics"""
+
+    def do_GET(self):
+        if urlsplit(self.path).path != '/status':
+            self.send_text(404, "Not found\n")
+            return
+        self.send_body(200, 'application/json', json.dumps(self.server.service.status(), indent=2).encode())
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        if url.path != '/render':
+            self.send_text(404, "Not found\n")
+            return
+
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        xml_data = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        try:
+            pdf_data = self.server.service.render(
+                xml_data,
+                layout_name=query.get('layout', DEFAULT_LAYOUT),
+                guide_style=query.get('guides', 'template'),
+                x_offset_cm=float(query.get('x_offset_cm', 0)),
+                compress=query.get('compress', '1') != '0'
+            )
+        except ValueError as e:
+            self.send_text(400, f"{e}\n")
+            return
+        except Exception:
+            traceback.print_exc()
+            self.send_text(500, "Rendering failed; see the service log\n")
+            return
+        self.send_body(200, 'application/pdf', pdf_data)
+
+    def send_text(self, status, text):
+        self.send_body(status, 'text/plain; charset=utf-8', text.encode())
+
+    def send_body(self, status, content_type, body):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Job lines are printed by the service; skip the per-request access log
+        pass
+
+
+def parse_args():
+    """Parse command line options"""
+    parser = argparse.ArgumentParser(
+        description="Serve card front rendering over local HTTP, keeping the image index and encoded images warm",
+        epilog=f"Example: curl --data-binary @assets/cards.xml "
+               f"'http://{DEFAULT_HOST}:{DEFAULT_PORT}/render?layout=letter&guides=template' -o fronts.pdf")
+    parser.add_argument('--host', default=DEFAULT_HOST,
+                        help=f"address to listen on (default: {DEFAULT_HOST}, local connections only)")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help=f"port to listen on (default: {DEFAULT_PORT})")
+    parser.add_argument('--fronts-dir', default="assets/fronts",
+                        help="directory of card front images (default: assets/fronts)")
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR,
+                        help=f"directory for cached image metadata and resampled images (default: {DEFAULT_CACHE_DIR})")
+    parser.add_argument('--cache-mb', type=int, default=DEFAULT_CACHE_MB,
+                        help=f"memory budget for encoded images kept between jobs (default: {DEFAULT_CACHE_MB})")
+    parser.add_argument('--resample-dpi', type=int, choices=RESAMPLE_DPI_CHOICES,
+                        help="resize each image to the exact pixel size for this print DPI before embedding")
+    parser.add_argument('--no-compress', action='store_true',
+                        help="never run Ghostscript, even for jobs that ask for compression")
+    parser.add_argument('--verbose', action='store_true', help="print every card placement")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+
+    if not os.path.exists(args.fronts_dir):
+        print(f"Fronts directory not found: {args.fronts_dir}")
+        return
+
+    service = RenderService(args.fronts_dir, args.cache_dir, args.cache_mb, args.resample_dpi,
+                            not args.no_compress, args.verbose)
+    service.image_index()
+
+    # One request at a time: the caches are not shared between threads
+    server = HTTPServer((args.host, args.port), RenderRequestHandler)
+    server.service = service
+    print(f"Serving on http://{args.host}:{args.port} (POST /render, GET /status)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nShutting down")
+    finally:
+        server.server_close()
+        service.close()
+
+if __name__ == "__main__":
+    main()
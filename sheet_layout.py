@@ -0,0 +1,125 @@
+import copy
+from string import ascii_uppercase
+from reportlab.lib.pagesizes import letter, A4, TABLOID, landscape, portrait
+
+# Points per millimetre
+MM = 72 / 25.4
+
+# Paper sizes (portrait) by name
+PAPER_SIZES = {
+    'letter': letter,
+    'a4': A4,
+    'tabloid': TABLOID,
+}
+
+# Standard card cut size and the bleed printed around it, in mm
+CARD_WIDTH_MM = 63
+CARD_HEIGHT_MM = 88
+BLEED_MM = 3.175
+
+# Unprintable strip most printers leave along each paper edge, in mm; card images must stay inside it
+PRINTABLE_MARGIN_MM = 4
+
+# Layout used when none is chosen; it is the original 8-up letter grid
+DEFAULT_LAYOUT = 'letter'
+
+
+class SheetLayout:
+    """Card grid on one sheet of paper, computed from the paper, card size, bleed, gaps and margins
+
+    The grid is centred on the page.  Slots are numbered row by row from the
+    top left, and every card gets a cut line on each of its four edges.
+    Images are drawn at the card size plus bleed on each side, and must
+    keep margin_mm clear of the paper edge, bleed included.
+    """
+
+    def __init__(self, name, paper, orientation, columns, rows, card_size_mm=(CARD_WIDTH_MM, CARD_HEIGHT_MM),
+                 bleed_mm=BLEED_MM, gap_mm=(6, 18), margin_mm=PRINTABLE_MARGIN_MM):
+        self.name = name
+        self.paper = paper
+        self.orientation = orientation
+        self.columns = columns
+        self.rows = rows
+        self.cards_per_page = columns * rows
+
+        paper_size = PAPER_SIZES[paper]
+        self.page_size = landscape(paper_size) if orientation == 'landscape' else portrait(paper_size)
+        page_width, page_height = self.page_size
+
+        self.card_width = card_size_mm[0] * MM
+        self.card_height = card_size_mm[1] * MM
+        self.bleed = bleed_mm * MM
+        self.image_width = self.card_width + 2 * self.bleed
+        column_pitch = self.card_width + gap_mm[0] * MM
+        row_pitch = self.card_height + gap_mm[1] * MM
+
+        grid_width = columns * self.card_width + (columns - 1) * gap_mm[0] * MM
+        grid_height = rows * self.card_height + (rows - 1) * gap_mm[1] * MM
+        left = (page_width - grid_width) / 2
+        bottom = (page_height - grid_height) / 2
+        if min(left, bottom) - self.bleed < margin_mm * MM:
+            raise ValueError(f"Layout {name}: a {columns}x{rows} grid of {card_size_mm[0]}x{card_size_mm[1]}mm cards "
+                             f"with {bleed_mm}mm bleed does not fit on {orientation} {paper} with {margin_mm}mm margins")
+
+        column_centres = [left + self.card_width / 2 + column * column_pitch for column in range(columns)]
+        # Rows run from the top of the page down
+        row_centres = [page_height - bottom - self.card_height / 2 - row * row_pitch for row in range(rows)]
+
+        self.points = [(slot_label(row * columns + column), x, y)
+                       for row, y in enumerate(row_centres)
+                       for column, x in enumerate(column_centres)]
+        self.cut_line_x = [x + side * self.card_width / 2 for x in column_centres for side in (1, -1)]
+        self.cut_line_y = [y + side * self.card_height / 2 for y in row_centres for side in (1, -1)]
+        self.row_gap_centres = [(row_centres[row] + row_centres[row + 1]) / 2 for row in range(rows - 1)]
+
+    def mirrored(self):
+        """Return a copy of the layout flipped left to right, for the backs of duplex sheets"""
+        page_width = self.page_size[0]
+        layout = copy.copy(self)
+        layout.name = f"{self.name}-mirrored"
+        layout.points = [(label, page_width - x, y) for label, x, y in self.points]
+        layout.cut_line_x = [page_width - x for x in self.cut_line_x]
+        return layout
+
+    def describe(self):
+        """Return a JSON-serialisable description of everything that affects how a sheet looks"""
+        return {
+            'name': self.name,
+            'page_size': list(self.page_size),
+            'points': self.points,
+            'cut_line_x': self.cut_line_x,
+            'cut_line_y': self.cut_line_y,
+            'image_width': self.image_width
+        }
+
+
+def slot_label(index):
+    """Return the label of a slot on the sheet: A-Z, then AA, AB, ..."""
+    label = ""
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        label = ascii_uppercase[remainder] + label
+    return label
+
+
+# Layouts selectable by name: (paper, orientation, columns, rows, options)
+LAYOUTS = {
+    # Matches the original template, whose outer columns' bleed comes to 1.5mm from the paper edge
+    'letter': ('letter', 'landscape', 4, 2, {'margin_mm': 1.5}),
+    'a4': ('a4', 'landscape', 4, 2, {}),
+    'tabloid': ('tabloid', 'landscape', 6, 2, {}),
+    'tabloid-10up': ('tabloid', 'landscape', 5, 2, {}),
+}
+
+
+def register_layout(name, paper, orientation, columns, rows, **options):
+    """Add a named layout so it can be chosen like the built-in ones"""
+    SheetLayout(name, paper, orientation, columns, rows, **options)  # Fail now if it cannot fit
+    LAYOUTS[name] = (paper, orientation, columns, rows, options)
+
+
+def get_layout(name=DEFAULT_LAYOUT):
+    """Build the named layout"""
+    paper, orientation, columns, rows, options = LAYOUTS[name]
+    return SheetLayout(name, paper, orientation, columns, rows, **options)
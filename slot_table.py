@@ -0,0 +1,96 @@
+from array import array
+
+# Code stored for a slot with no card
+EMPTY = -1
+
+
+class SlotTable:
+    """Slot number -> card ID table backed by a compact integer array
+
+    Card IDs are interned: each distinct ID gets an integer code and the
+    table stores one 4-byte code per slot instead of a reference per slot.
+    Slots claimed twice are recorded in collisions (the first card keeps the
+    slot) and slots nobody claimed can be listed with gaps().
+    """
+
+    def __init__(self, size):
+        self.codes = array('i', [EMPTY]) * size
+        self.card_ids = []
+        self._code_for_id = {}
+        self.collisions = []
+
+    @classmethod
+    def from_cards(cls, cards):
+        """Build a table sized to the highest slot used by the cards"""
+        size = max((max(card['slots']) + 1 for card in cards if card['slots']), default=0)
+        table = cls(size)
+        for card in cards:
+            for slot in card['slots']:
+                table.assign(slot, card['id'])
+        return table
+
+    def intern(self, card_id):
+        """Return the integer code for a card ID, adding it if new"""
+        code = self._code_for_id.get(card_id)
+        if code is None:
+            code = len(self.card_ids)
+            self._code_for_id[card_id] = code
+            self.card_ids.append(card_id)
+        return code
+
+    def assign(self, slot, card_id):
+        """Put a card in a slot, recording a collision if the slot is already taken"""
+        code = self.intern(card_id)
+        existing = self.codes[slot]
+        if existing != EMPTY and existing != code:
+            self.collisions.append((slot, self.card_ids[existing], card_id))
+            return
+        self.codes[slot] = code
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, slot):
+        code = self.codes[slot]
+        return None if code == EMPTY else self.card_ids[code]
+
+    def __iter__(self):
+        card_ids = self.card_ids
+        for code in self.codes:
+            yield None if code == EMPTY else card_ids[code]
+
+    def gaps(self):
+        """Return the slots that no card claimed"""
+        return [slot for slot, code in enumerate(self.codes) if code == EMPTY]
+
+    def page_count(self, cards_per_page):
+        """Return the number of pages needed for the table"""
+        return (len(self.codes) + cards_per_page - 1) // cards_per_page
+
+    def page(self, page_num, cards_per_page):
+        """Return a view of the slots on one page, without copying them"""
+        start = page_num * cards_per_page
+        end = min(start + cards_per_page, len(self.codes))
+        return SlotView(self, start, end)
+
+
+class SlotView:
+    """Read-only window onto a run of slots in a SlotTable"""
+
+    def __init__(self, table, start, end):
+        self.table = table
+        self.start = start
+        self.end = end
+        self._codes = memoryview(table.codes)[start:end]
+
+    def __len__(self):
+        return len(self._codes)
+
+    def __getitem__(self, index):
+        code = self._codes[index]
+        return None if code == EMPTY else self.table.card_ids[code]
+
+    def __iter__(self):
+        card_ids = self.table.card_ids
+        for code in self._codes:
+            yield None if code == EMPTY else card_ids[code]
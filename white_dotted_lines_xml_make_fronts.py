@@ -1,8 +1,6 @@
 import xml.etree.ElementTree as ET
-from reportlab.lib.pagesizes import letter, landscape
 from reportlab.pdfgen import canvas
 from reportlab.lib.units import mm
-from reportlab.lib.colors import lightgrey
 from PIL import Image
 import os
 import shutil
@@ -11,6 +9,9 @@ from reportlab.pdfgen import canvas
 from io import BytesIO
 import subprocess
 import sys
+from image_index import ImageIndex
+from cut_guides import CutGuides
+from sheet_layout import get_layout
 
 # Configuration for offset
 DEFAULT_OFFSET_CM = 0.11  # Default offset in centimeters
@@ -67,28 +68,24 @@ def create_slot_list(cards):
     
     return slot_list
 
-def find_image_by_id(card_id, fronts_dir):
+def find_image_by_id(card_id, image_index):
     """Find an image file that contains the given card ID in its filename"""
     if not card_id:
         return None
     
-    image_extensions = ['.jpg', '.jpeg', '.png', '.gif', '.bmp']
-    
-    for filename in os.listdir(fronts_dir):
-        if any(filename.lower().endswith(ext) for ext in image_extensions):
-            if card_id in filename:
-                return filename
-    
-    return None
+    return image_index.find(card_id)
 
-def check_images_exist(slot_list, fronts_dir):
+def check_images_exist(slot_list, image_index):
     """Check if all required images exist by looking for card IDs in filenames"""
     missing_images = []
     existing_images = []
     
+    # Resolve every ID in one pass over the directory listing
+    image_index.resolve(slot_list)
+    
     for i, card_id in enumerate(slot_list):
         if card_id:
-            image_filename = find_image_by_id(card_id, fronts_dir)
+            image_filename = find_image_by_id(card_id, image_index)
             if image_filename:
                 existing_images.append(image_filename)
             else:
@@ -96,83 +93,21 @@ def check_images_exist(slot_list, fronts_dir):
     
     return missing_images, existing_images
 
-def draw_edge_cut_lines(overlay_canvas, page_width, page_height, x_offset=OFFSET_POINTS):
-    """Draw light gray dotted lines at the edges for cutting guides with offset"""
-    # Define y coordinates for horizontal dotted lines (no change needed for horizontal lines' y-coords)
-    y_coords = [
-        580.9604567,
-        331.511795,
-        280.488205,
-        31.03954328,
-    ]
-    
-    # Define x coordinates for vertical dotted lines (these will be offset)
-    x_coords = [
-        191.9056404 + x_offset,
-        13.3230757 + x_offset,
-        387.4960683 + x_offset,
-        208.9135037 + x_offset,
-        583.0864963 + x_offset,
-        404.5039317 + x_offset,
-        778.6769243 + x_offset,
-        600.0943596 + x_offset,
-    ]
-    
-    # Set up line style - light gray dotted lines
-    overlay_canvas.setDash([4, 1])  # Set dash pattern: 4 points on, 1 point off
-    overlay_canvas.setLineWidth(0.5)
-    overlay_canvas.setStrokeColor(lightgrey)
-    
-    # Horizontal lines: 2 inches (144 points) on each edge
-    edge_width_horizontal = 2 * 72  # 144 points
-    
-    # Draw horizontal dotted lines only at the edges (2 inches from each side)
-    # Apply offset to horizontal lines as well
-    for y in y_coords:
-        # Left edge (first 2 inches) - shifted right by offset
-        overlay_canvas.line(0 + x_offset, y, edge_width_horizontal + x_offset, y)
-        # Right edge (last 2 inches) - shifted right by offset
-        overlay_canvas.line(page_width - edge_width_horizontal + x_offset, y, page_width + x_offset, y)
-    
-    # Vertical lines: 1 inch on each end, 2 inches in the middle
-    edge_height_vertical = 1 * 72  # 72 points (1 inch)
-    middle_height = 2 * 72  # 144 points (2 inches)
-    middle_start = (page_height / 2) - (middle_height / 2)
-    middle_end = (page_height / 2) + (middle_height / 2)
-    
-    # Draw vertical dotted lines (already offset in x_coords)
-    for x in x_coords:
-        # Bottom edge (first 1 inch)
-        overlay_canvas.line(x, 0, x, edge_height_vertical)
-        # Top edge (last 1 inch)
-        overlay_canvas.line(x, page_height - edge_height_vertical, x, page_height)
-        # Middle section (2 inches in the center)
-        overlay_canvas.line(x, middle_start, x, middle_end)
-    
-    # Reset to solid lines and default color for any subsequent drawing
-    overlay_canvas.setDash([])
-
-def create_page_with_cards(page_card_ids, page_width, page_height, fronts_dir, x_offset=OFFSET_POINTS):
-    """Create a single page with up to 8 cards using card IDs, with edge cut lines on top and offset"""
-    # Define points with their coordinates (apply offset to x-coordinates)
-    points = [
-        ("A", 102.614358 + x_offset, 456.2361258),
-        ("B", 298.204786 + x_offset, 456.2361258),
-        ("C", 493.795214 + x_offset, 456.2361258),
-        ("D", 689.385642 + x_offset, 456.2361258),
-        ("E", 102.614358 + x_offset, 155.7638742),
-        ("F", 298.204786 + x_offset, 155.7638742),
-        ("G", 493.795214 + x_offset, 155.7638742),
-        ("H", 689.385642 + x_offset, 155.7638742)
-    ]
+def create_page_with_cards(page_card_ids, layout, image_index, x_offset=OFFSET_POINTS):
+    """Create a single page with up to 8 cards using card IDs, with the template guides beneath and edge cut lines on top"""
+    # Apply offset to the x-coordinates of the card points
+    points = [(label, x + x_offset, y) for label, x, y in layout.points]
     
     # Create a canvas in memory
     packet = BytesIO()
-    overlay_canvas = canvas.Canvas(packet, pagesize=(page_width, page_height))
+    overlay_canvas = canvas.Canvas(packet, pagesize=layout.page_size)
+    
+    # Template lines and points go under the cards, the offset edge lines over them
+    cut_guides = CutGuides(overlay_canvas, 'dotted-edges', layout, x_offset)
+    cut_guides.draw('under')
     
-    # Target width in mm and convert to points
-    target_width_mm = 69.35
-    target_width_points = target_width_mm * 72 / 25.4
+    # Card width plus bleed, in points
+    target_width_points = layout.image_width
     
     # Process each image position
     for i, (label, x, y) in enumerate(points):
@@ -180,12 +115,12 @@ def create_page_with_cards(page_card_ids, page_width, page_height, fronts_dir, x
             card_id = page_card_ids[i]
             
             # Find the image file for this card ID
-            image_filename = find_image_by_id(card_id, fronts_dir)
+            image_filename = find_image_by_id(card_id, image_index)
             if not image_filename:
                 print(f"  Warning: No image found for card ID {card_id}")
                 continue
             
-            image_path = os.path.join(fronts_dir, image_filename)
+            image_path = os.path.join(image_index.image_dir, image_filename)
             
             try:
                 # Open and process the image
@@ -212,7 +147,7 @@ def create_page_with_cards(page_card_ids, page_width, page_height, fronts_dir, x
                 continue
     
     # Draw edge cut lines ON TOP of the cards with the same offset
-    draw_edge_cut_lines(overlay_canvas, page_width, page_height, x_offset)
+    cut_guides.draw('over')
     
     overlay_canvas.save()
     packet.seek(0)
@@ -246,7 +181,6 @@ def main():
     # Configuration
     xml_path = "assets/cards.xml"
     fronts_dir = "assets/fronts"
-    template_pdf = "template_cut_lines.pdf"
     output_dir = "./output"
     uncompressed_dir = os.path.join(output_dir, "uncompressed_pdfs")
     compressed_dir = os.path.join(output_dir, "compressed_pdfs")
@@ -259,8 +193,8 @@ def main():
     
     print(f"Using horizontal offset: {x_offset_cm}cm ({x_offset_points:.2f} points)")
     
-    # Set up page size (landscape 8.5x11 inches)
-    page_width, page_height = landscape(letter)
+    # Sheet layout (landscape 8.5x11 inches, 8 cards per page)
+    layout = get_layout()
     
     # Check if Ghostscript is available
     has_ghostscript = check_and_install_ghostscript()
@@ -279,11 +213,6 @@ def main():
         print(f"XML file not found: {xml_path}")
         return
     
-    if not os.path.exists(template_pdf):
-        print(f"Template PDF not found: {template_pdf}")
-        print("Please run the original script first to generate the template.")
-        return
-    
     if not os.path.exists(fronts_dir):
         print(f"Fronts directory not found: {fronts_dir}")
         return
@@ -297,9 +226,17 @@ def main():
     slot_list = create_slot_list(cards)
     print(f"Total slots needed: {len(slot_list)}")
     
-    # Check if all images exist (now searches by card ID)
+    # Index the fronts directory once; both the check and the rendering use it
     print("\nChecking images...")
-    missing_images, existing_images = check_images_exist(slot_list, fronts_dir)
+    image_index = ImageIndex(fronts_dir)
+    print(f"Indexed {len(image_index)} images in {fronts_dir}")
+    missing_images, existing_images = check_images_exist(slot_list, image_index)
+    
+    ambiguous_images = image_index.ambiguous(slot_list)
+    if ambiguous_images:
+        print("Warning: Card IDs matching several image files (using the first):")
+        for card_id, filenames in sorted(ambiguous_images.items()):
+            print(f"  {card_id}: {', '.join(filenames)}")
     
     if missing_images:
         print("ERROR: Missing images for card IDs:")
@@ -310,7 +247,7 @@ def main():
     print(f"All required images found ({len(set(existing_images))} unique images)")
     
     # Calculate pages needed (8 cards per page)
-    cards_per_page = 8
+    cards_per_page = layout.cards_per_page
     total_pages = (len(slot_list) + cards_per_page - 1) // cards_per_page
     print(f"Will generate {total_pages} pages")
     
@@ -325,29 +262,13 @@ def main():
         
         print(f"Page {page_num + 1}: slots {start_slot}-{end_slot - 1}")
         
-        # Create overlay with cards and edge cut lines (with offset)
-        overlay_packet = create_page_with_cards(page_card_ids, page_width, page_height, fronts_dir, x_offset_points)
-        
-        # Read template fresh for each page to avoid stacking
-        template_reader = PdfReader(template_pdf)
-        template_page = template_reader.pages[0]
-        
-        # Merge with overlay
-        overlay_reader = PdfReader(overlay_packet)
-        output_writer = PdfWriter()
-        
-        # Copy template page and merge with overlay
-        merged_page = template_page
-        if len(overlay_reader.pages) > 0:
-            overlay_page = overlay_reader.pages[0]
-            merged_page.merge_page(overlay_page)
-        
-        output_writer.add_page(merged_page)
+        # Create the page with cards and cut guides (with offset); it needs no merging
+        page_packet = create_page_with_cards(page_card_ids, layout, image_index, x_offset_points)
         
         # Save uncompressed PDF
         uncompressed_file = os.path.join(uncompressed_dir, f"page_{page_num + 1:03d}.pdf")
         with open(uncompressed_file, 'wb') as output_file:
-            output_writer.write(output_file)
+            output_file.write(page_packet.getvalue())
         
         uncompressed_files.append(uncompressed_file)
         print(f"  Saved: {uncompressed_file}")
@@ -1,8 +1,5 @@
-import xml.etree.ElementTree as ET
-from reportlab.lib.pagesizes import letter, landscape
 from reportlab.pdfgen import canvas
 from reportlab.lib.units import mm
-from PIL import Image
 import os
 import shutil
 from PyPDF2 import PdfReader, PdfWriter
@@ -10,6 +7,33 @@ from reportlab.pdfgen import canvas
 from io import BytesIO
 import subprocess
 import sys
+import argparse
+from collections import deque
+from itertools import chain, count
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from cards_xml import read_order
+from image_index import ImageIndex
+from slot_table import SlotTable
+from image_metadata import ImageMetadataStore, DEFAULT_CACHE_DIR, hash_file
+from image_resample import ResampleCache, RESAMPLE_DPI_CHOICES
+from image_registry import ImageRegistry
+from pdf_stream import PdfStreamWriter
+from render_cache import RenderCache
+from page_template import PageTemplate
+from instrumentation import profiler
+from cut_guides import CutGuides, GUIDE_STYLES
+from sheet_layout import LAYOUTS, DEFAULT_LAYOUT, get_layout
+from image_object_cache import ImageObjectCache
+from asset_index import AssetIndex, NEAR_DUPLICATE_DISTANCE
+from image_prefetch import ImagePrefetcher, DEFAULT_PREFETCH_THREADS
+from image_bleed import BleedCache, BLEED_MODES
+from color_management import ColorCache, SRGB_PROFILE, load_profile
+
+# Encoded images a process keeps between the page windows it draws, so each image is encoded once per process
+_window_image_cache = ImageObjectCache()
+
+# The job a window worker process draws its windows from, set once by init_window_worker
+_window_job = {}
 
 def check_and_install_ghostscript():
     """Check if Ghostscript is available for PDF compression"""
@@ -21,69 +45,42 @@ def check_and_install_ghostscript():
         print("Install Ghostscript for PDF compression functionality.")
         return False
 
-def parse_xml_cards(xml_path):
-    """Parse the XML file and return card information"""
-    tree = ET.parse(xml_path)
-    root = tree.getroot()
-    
-    cards = []
-    for card_elem in root.find('fronts').findall('card'):
-        # Skip empty cards
-        if card_elem.find('id') is None or card_elem.find('slots') is None:
-            continue
-            
-        card_id = card_elem.find('id').text
-        slots_text = card_elem.find('slots').text
-        name = card_elem.find('name').text
-        query = card_elem.find('query').text if card_elem.find('query') is not None else ""
-        
-        # Parse slots
-        slots = [int(slot.strip()) for slot in slots_text.split(',')]
-        
-        cards.append({
-            'id': card_id,
-            'slots': slots,
-            'name': name,
-            'query': query
-        })
-    
-    return cards
+def create_slot_table(cards):
+    """Create a slot table where each slot number maps to the card ID placed there"""
+    return SlotTable.from_cards(cards)
 
-def create_slot_list(cards):
-    """Create a list where each index represents a slot and contains the card ID"""
-    slot_list = []
-    
-    for card in cards:
+def create_back_table(slot_table, back_cards, cardback_id):
+    """Create the slot table for the backs: per-card backs where given, the common back in every other used slot"""
+    back_table = SlotTable(len(slot_table))
+    for card in back_cards:
         for slot in card['slots']:
-            # Ensure we have enough slots in our list
-            while len(slot_list) <= slot:
-                slot_list.append(None)
-            slot_list[slot] = card['id']
-    
-    return slot_list
+            if slot < len(back_table):
+                back_table.assign(slot, card['id'])
+    
+    if cardback_id:
+        for slot, card_id in enumerate(slot_table):
+            if card_id and back_table[slot] is None:
+                back_table.assign(slot, cardback_id)
+    return back_table
 
-def find_image_by_id(card_id, fronts_dir):
+def find_image_by_id(card_id, image_index):
     """Find an image file that contains the given card ID in its filename"""
     if not card_id:
         return None
     
-    image_extensions = ['.jpg', '.jpeg', '.png', '.gif', '.bmp']
-    
-    for filename in os.listdir(fronts_dir):
-        if any(filename.lower().endswith(ext) for ext in image_extensions):
-            if card_id in filename:
-                return filename
-    
-    return None
+    return image_index.find(card_id)
 
-def check_images_exist(slot_list, fronts_dir):
+def check_images_exist(slot_table, image_index):
     """Check if all required images exist by looking for card IDs in filenames"""
     missing_images = []
     existing_images = []
     
-    for i, card_id in enumerate(slot_list):
+    # Resolve every ID in one pass over the directory listing
+    image_index.resolve(slot_table.card_ids)
+    
+    for i, card_id in enumerate(slot_table):
         if card_id:
-            image_filename = find_image_by_id(card_id, fronts_dir)
+            image_filename = find_image_by_id(card_id, image_index)
             if image_filename:
                 existing_images.append(image_filename)
             else:
@@ -91,69 +88,166 @@ def check_images_exist(slot_list, fronts_dir):
     
     return missing_images, existing_images
 
-def create_page_with_cards(page_card_ids, page_width, page_height, fronts_dir):
-    """Create a single page with up to 8 cards using card IDs"""
-    # Define points with their coordinates (same as original)
-    points = [
-        ("A", 102.614358, 456.2361258),
-        ("B", 298.204786, 456.2361258),
-        ("C", 493.795214, 456.2361258),
-        ("D", 689.385642, 456.2361258),
-        ("E", 102.614358, 155.7638742),
-        ("F", 298.204786, 155.7638742),
-        ("G", 493.795214, 155.7638742),
-        ("H", 689.385642, 155.7638742)
-    ]
-    
-    # Create a canvas in memory
-    packet = BytesIO()
-    overlay_canvas = canvas.Canvas(packet, pagesize=(page_width, page_height))
-    
-    # Target width in mm and convert to points
-    target_width_mm = 69.35
-    target_width_points = target_width_mm * 72 / 25.4
+def create_page_with_cards(page_card_ids, overlay_canvas, image_registry, layout, cut_guides=None, x_offset=0, log=print):
+    """Draw a single page with a sheet's worth of cards using card IDs onto the shared overlay canvas"""
+    if cut_guides:
+        cut_guides.draw('under')
     
     # Process each image position
-    for i, (label, x, y) in enumerate(points):
+    for i, (label, x, y) in enumerate(layout.points):
         if i < len(page_card_ids) and page_card_ids[i]:
             card_id = page_card_ids[i]
             
-            # Find the image file for this card ID
-            image_filename = find_image_by_id(card_id, fronts_dir)
-            if not image_filename:
-                print(f"  Warning: No image found for card ID {card_id}")
-                continue
-            
-            image_path = os.path.join(fronts_dir, image_filename)
-            
             try:
-                # Open and process the image
-                img = Image.open(image_path)
+                # Embeds the image the first time the card ID is seen, references it after that
+                entry = image_registry.place(card_id, x + x_offset, y)
+                if entry is None:
+                    log(f"  Warning: No image found for card ID {card_id}")
+                    continue
                 
-                # Calculate the aspect ratio to maintain proportions
-                aspect_ratio = img.height / img.width
-                target_height_points = target_width_points * aspect_ratio
-                
-                # Calculate position to center the image on the point
-                img_x = x - (target_width_points / 2)
-                img_y = y - (target_height_points / 2)
-                
-                # Draw the image on the overlay canvas
-                overlay_canvas.drawImage(image_path,
-                                       img_x, img_y,
-                                       width=target_width_points,
-                                       height=target_height_points)
-                
-                print(f"  Placed {image_filename} at point {label}")
+                log(f"  Placed {entry['filename']} at point {label}")
                 
             except Exception as e:
-                print(f"  Error processing {image_filename}: {e}")
+                log(f"  Error processing {card_id}: {e}")
                 continue
     
-    overlay_canvas.save()
+    if cut_guides:
+        cut_guides.draw('over')
+    
+    overlay_canvas.showPage()
+
+def create_overlay_document(slot_table, page_numbers, layout, image_index, image_metadata, image_sources=None,
+                            guide_style='none', x_offset=0, log=print, image_cache=None,
+                            prefetch_threads=DEFAULT_PREFETCH_THREADS):
+    """Draw the given pages, cut guides included, into one document so each image is embedded once"""
+    # Create a canvas in memory
+    packet = BytesIO()
+    overlay_canvas = canvas.Canvas(packet, pagesize=layout.page_size)
+    
+    image_registry = ImageRegistry(overlay_canvas, image_index, image_metadata, layout.image_width, image_sources,
+                                   image_cache)
+    cut_guides = CutGuides(overlay_canvas, guide_style, layout, x_offset)
+    cards_per_page = layout.cards_per_page
+    
+    if prefetch_threads:
+        card_ids = chain.from_iterable(slot_table.page(page_num, cards_per_page) for page_num in page_numbers)
+        image_registry.prefetcher = ImagePrefetcher(image_registry.embed_paths(card_ids), prefetch_threads,
+                                                    image_cache=image_cache)
+    try:
+        for page_num in page_numbers:
+            start_slot = page_num * cards_per_page
+            end_slot = min(start_slot + cards_per_page, len(slot_table))
+            page_card_ids = slot_table.page(page_num, cards_per_page)
+            
+            log(f"Page {page_num + 1}: slots {start_slot}-{end_slot - 1}")
+            create_page_with_cards(page_card_ids, overlay_canvas, image_registry, layout, cut_guides, x_offset, log)
+    finally:
+        if image_registry.prefetcher:
+            image_registry.prefetcher.close()
+    
+    with profiler.stage('encode_pdf'):
+        overlay_canvas.save()
     packet.seek(0)
+    profiler.count('pages_drawn', len(page_numbers))
+    log(f"Embedded {len(image_registry)} unique images")
     return packet
 
+def init_window_worker(slot_table, layout, image_index, image_metadata, image_sources, guide_style, x_offset,
+                       profile, prefetch_threads):
+    """Set up the job shared by every window a worker process draws, so only page ranges are sent per window"""
+    if profile:
+        profiler.enable()
+        # A forked worker starts with a copy of the parent's figures, which the parent already has
+        profiler.collect()
+    _window_job.update({
+        'slot_table': slot_table,
+        'layout': layout,
+        'image_index': image_index,
+        'image_metadata': image_metadata,
+        'image_sources': image_sources,
+        'guide_style': guide_style,
+        'x_offset': x_offset,
+        'profile': profile,
+        'prefetch_threads': prefetch_threads
+    })
+
+def render_overlay_chunk(page_numbers):
+    """Worker entry point: draw a range of the job's pages and return the PDF bytes, log lines and profile data"""
+    job = _window_job
+    log_lines = []
+    packet = create_overlay_document(job['slot_table'], page_numbers, job['layout'], job['image_index'],
+                                     job['image_metadata'], job['image_sources'], job['guide_style'],
+                                     job['x_offset'], log_lines.append, _window_image_cache, job['prefetch_threads'])
+    return packet.getvalue(), log_lines, profiler.collect() if job['profile'] else None
+
+def plan_windows(page_numbers, workers=1, window_pages=0):
+    """Split the pages into the runs drawn as separate documents: window_pages each, or one run per worker"""
+    page_numbers = list(page_numbers)
+    if window_pages:
+        return [page_numbers[start:start + window_pages] for start in range(0, len(page_numbers), window_pages)]
+    window_count = max(1, min(workers, len(page_numbers)))
+    return [page_numbers[len(page_numbers) * i // window_count:len(page_numbers) * (i + 1) // window_count]
+            for i in range(window_count)]
+
+def render_overlay_windows(slot_table, layout, image_index, image_metadata, image_sources=None, workers=1,
+                           page_numbers=None, guide_style='none', x_offset=0, window_pages=0,
+                           prefetch_threads=DEFAULT_PREFETCH_THREADS):
+    """Draw the pages run by run, in a process pool when workers > 1, yielding each run's PDF bytes in page order"""
+    if page_numbers is None:
+        page_numbers = range(slot_table.page_count(layout.cards_per_page))
+    windows = [window for window in plan_windows(page_numbers, workers, window_pages) if window]
+    
+    if workers <= 1 or len(windows) <= 1:
+        image_cache = _window_image_cache if len(windows) > 1 else None
+        for window in windows:
+            packet = create_overlay_document(slot_table, window, layout, image_index, image_metadata,
+                                             image_sources, guide_style, x_offset, print, image_cache,
+                                             prefetch_threads)
+            yield packet.getvalue()
+        return
+    
+    max_workers = min(workers, len(windows))
+    initargs = (slot_table, layout, image_index, image_metadata, image_sources, guide_style, x_offset,
+                profiler.enabled, prefetch_threads)
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=init_window_worker, initargs=initargs) as executor:
+        pending = deque()
+        
+        def finished():
+            # Collect in submission order so pages and their log lines come out deterministically
+            window, future = pending.popleft()
+            try:
+                pdf_bytes, log_lines, profile_data = future.result()
+            except Exception as e:
+                raise RuntimeError(f"Rendering pages {window[0] + 1}-{window[-1] + 1} failed: {e}")
+            
+            for line in log_lines:
+                print(line)
+            profiler.merge(profile_data)
+            return pdf_bytes
+        
+        for window in windows:
+            pending.append((window, executor.submit(render_overlay_chunk, window)))
+            if len(pending) >= max_workers:
+                yield finished()
+        while pending:
+            yield finished()
+
+def render_overlay_pages(slot_table, layout, image_index, image_metadata, image_sources=None, workers=1,
+                         page_numbers=None, guide_style='none', x_offset=0, prefetch_threads=DEFAULT_PREFETCH_THREADS):
+    """Draw the pages (all of them by default) and return the rendered documents as a list of PDF bytes"""
+    try:
+        return list(render_overlay_windows(slot_table, layout, image_index, image_metadata, image_sources, workers,
+                                           page_numbers, guide_style, x_offset, prefetch_threads=prefetch_threads))
+    except RuntimeError as e:
+        print(f"ERROR: {e}")
+        return None
+
+def document_pages(documents, page_template=None):
+    """Yield the pages of the rendered documents in order, stamped with the template PDF if one is used"""
+    for pdf_bytes in documents:
+        for page in PdfReader(BytesIO(pdf_bytes)).pages:
+            yield page_template.stamp(page) if page_template else page
+
 def compress_pdf(input_path, output_path):
     """Compress PDF to 1200 DPI using Ghostscript"""
     try:
@@ -172,63 +266,343 @@ def compress_pdf(input_path, output_path):
             input_path
         ]
         
+        profiler.count('ghostscript_runs')
         subprocess.run(cmd, check=True, capture_output=True)
         return True
     except subprocess.CalledProcessError as e:
         print(f"Error compressing {input_path}: {e}")
         return False
 
+def compress_pdfs(jobs, max_jobs=1):
+    """Compress (input_path, output_path) jobs with up to max_jobs Ghostscript processes, yielding results in order"""
+    max_jobs = max(1, max_jobs)
+    with ThreadPoolExecutor(max_workers=max_jobs) as executor:
+        pending = deque()
+        for job in jobs:
+            pending.append((job, executor.submit(compress_pdf, *job)))
+            # One job queued behind each running one is enough to keep Ghostscript busy
+            if len(pending) >= 2 * max_jobs:
+                (input_path, output_path), future = pending.popleft()
+                yield input_path, output_path, future.result()
+        while pending:
+            (input_path, output_path), future = pending.popleft()
+            yield input_path, output_path, future.result()
+
+def write_document(documents, final_pdf, has_ghostscript, page_template=None):
+    """Write the rendered documents (a list or a lazy iterable) out as one PDF in a single pass"""
+    # Ghostscript needs a file to read, so the document is written once next to the output
+    uncompressed_pdf = os.path.splitext(final_pdf)[0] + "_uncompressed.pdf" if has_ghostscript else final_pdf
+    
+    documents = iter(documents)
+    first_document = next(documents, None)
+    second_document = next(documents, None)
+    if first_document is not None and second_document is None and page_template is None:
+        # The cut guides are drawn into the document already, so it is used exactly as rendered
+        with open(uncompressed_pdf, 'wb') as output_file:
+            output_file.write(first_document)
+    else:
+        with profiler.stage('assemble'), PdfStreamWriter(uncompressed_pdf) as document_writer:
+            # Rendered documents are read as the writer reaches them and released once their pages are written;
+            # cards repeated across documents are stored once
+            pages = document_pages(chain(filter(None, [first_document, second_document]), documents), page_template)
+            for page_num, page in enumerate(pages):
+                document_writer.add_page(page)
+                print(f"  Added page {page_num + 1}")
+    
+    if not has_ghostscript:
+        print("\nSkipping compression (Ghostscript not available or --no-compress given)")
+        profiler.count_file(final_pdf)
+        return
+    
+    print("\nCompressing PDF to 1200 DPI...")
+    with profiler.stage('compress'):
+        compressed = compress_pdf(uncompressed_pdf, final_pdf)
+    profiler.count_file(final_pdf if compressed else uncompressed_pdf)
+    if compressed:
+        print(f"  Compressed: {os.path.basename(final_pdf)}")
+        os.remove(uncompressed_pdf)
+    else:
+        print(f"  Failed to compress: {os.path.basename(final_pdf)}")
+        # Use uncompressed version as fallback
+        os.replace(uncompressed_pdf, final_pdf)
+
+def write_page_files(pages, page_paths):
+    """Write each page to its own PDF as it arrives, yielding the file written"""
+    for page, page_file in zip(pages, page_paths):
+        output_writer = PdfWriter()
+        output_writer.add_page(page)
+        with open(page_file, 'wb') as output_file:
+            output_writer.write(output_file)
+        profiler.count_file(page_file)
+        yield page_file
+
+def write_debug_pages(pages, uncompressed_dir, compressed_dir, has_ghostscript, gs_jobs=1):
+    """Write each page to its own uncompressed and compressed PDF, yielding the compressed files in page order"""
+    # Create/clean output directories
+    if os.path.exists(uncompressed_dir):
+        shutil.rmtree(uncompressed_dir)
+    os.makedirs(uncompressed_dir, exist_ok=True)
+    
+    if os.path.exists(compressed_dir):
+        shutil.rmtree(compressed_dir)
+    os.makedirs(compressed_dir, exist_ok=True)
+    
+    page_names = (f"page_{page_num:03d}.pdf" for page_num in count(1))
+    uncompressed_files = write_page_files(pages, (os.path.join(uncompressed_dir, name) for name in page_names))
+    
+    # Compress PDFs if Ghostscript is available
+    if has_ghostscript:
+        print("\nWriting and compressing pages to 1200 DPI...")
+        jobs = ((uncompressed_file, os.path.join(compressed_dir, os.path.basename(uncompressed_file)))
+                for uncompressed_file in uncompressed_files)
+        for uncompressed_file, compressed_file, succeeded in compress_pdfs(jobs, gs_jobs):
+            filename = os.path.basename(uncompressed_file)
+            profiler.count_file(compressed_file)
+            
+            if succeeded:
+                print(f"  Compressed: {filename}")
+            else:
+                print(f"  Failed to compress: {filename}")
+                # Use uncompressed version as fallback
+                shutil.copy2(uncompressed_file, compressed_file)
+            yield compressed_file
+    else:
+        print("\nWriting pages (Ghostscript not available or --no-compress given)...")
+        # Copy uncompressed files to compressed directory
+        for uncompressed_file in uncompressed_files:
+            filename = os.path.basename(uncompressed_file)
+            compressed_file = os.path.join(compressed_dir, filename)
+            shutil.copy2(uncompressed_file, compressed_file)
+            print(f"  Saved: {filename}")
+            yield compressed_file
+
+def write_cached_pages(page_numbers, pages, page_keys, render_cache, has_ghostscript, gs_jobs=1):
+    """Compress and store newly rendered pages in the render cache, returning {key: file} for pages left out of it"""
+    uncached_files = {}
+    if not page_numbers:
+        return uncached_files
+    
+    keys = {render_cache.path(page_keys[page_num]): page_keys[page_num] for page_num in page_numbers}
+    cached_files = [render_cache.path(page_keys[page_num]) for page_num in page_numbers]
+    uncompressed_files = write_page_files(pages, (cached_file + ".uncompressed" for cached_file in cached_files))
+    
+    if not has_ghostscript:
+        for uncompressed_file, cached_file in zip(uncompressed_files, cached_files):
+            os.replace(uncompressed_file, cached_file)
+        return uncached_files
+    
+    print("\nCompressing PDFs to 1200 DPI...")
+    # Ghostscript writes next to the cache entry, which only appears once the page is complete
+    jobs = ((uncompressed_file, cached_file + ".tmp")
+            for uncompressed_file, cached_file in zip(uncompressed_files, cached_files))
+    for uncompressed_file, temp_file, succeeded in compress_pdfs(jobs, gs_jobs):
+        cached_file = temp_file[:-len(".tmp")]
+        if succeeded:
+            os.replace(temp_file, cached_file)
+            profiler.count_file(cached_file)
+            print(f"  Compressed: {os.path.basename(cached_file)}")
+            os.remove(uncompressed_file)
+        else:
+            print(f"  Failed to compress: {os.path.basename(cached_file)}")
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+            # The uncompressed page goes into this run's output only; its key promises a compressed page,
+            # so caching it would stop later runs from ever trying again
+            uncached_files[keys[cached_file]] = uncompressed_file
+    return uncached_files
+
+def combine_pages(page_files, final_pdf):
+    """Combine per-page PDFs into the final PDF, storing each distinct image once"""
+    print("\nCombining pages into final PDF...")
+    with PdfStreamWriter(final_pdf) as final_writer:
+        for page_file in page_files:
+            for page in PdfReader(page_file).pages:
+                final_writer.add_page(page)
+    print(f"  Combined {len(final_writer)} pages")
+    profiler.count_file(final_pdf)
+
+def interleave_pages(front_pdf, back_pdf, output_pdf):
+    """Write a duplex PDF alternating each front page with its back page"""
+    print(f"\nInterleaving fronts and backs into {os.path.basename(output_pdf)}...")
+    front_reader = PdfReader(front_pdf)
+    back_reader = PdfReader(back_pdf)
+    
+    with PdfStreamWriter(output_pdf) as output_writer:
+        for front_page, back_page in zip(front_reader.pages, back_reader.pages):
+            output_writer.add_page(front_page)
+            output_writer.add_page(back_page)
+    profiler.count_file(output_pdf)
+
+def parse_args():
+    """Parse command line options"""
+    parser = argparse.ArgumentParser(description="Lay out the card fronts listed in cards.xml onto printable sheets")
+    page_mode = parser.add_mutually_exclusive_group()
+    page_mode.add_argument('--debug-pages', action='store_true',
+                           help="also write every page to uncompressed_pdfs/ and compressed_pdfs/ and build fronts.pdf from them")
+    parser.add_argument('--workers', type=int, default=1, metavar='N',
+                        help="render pages in N worker processes (default: 1)")
+    parser.add_argument('--window-pages', type=int, default=0, metavar='N',
+                        help="render, write and compress N pages at a time and release them before the next N, "
+                             "keeping memory flat for very large orders (default: 0, one document per worker)")
+    parser.add_argument('--prefetch-threads', type=int, default=DEFAULT_PREFETCH_THREADS, metavar='N',
+                        help="read and encode the images of upcoming pages on N background threads per renderer, "
+                             f"overlapping file reads with drawing (default: {DEFAULT_PREFETCH_THREADS}; 0 to read "
+                             "each image when it is placed)")
+    parser.add_argument('--gs-jobs', type=int, default=os.cpu_count() or 1, metavar='N',
+                        help="run up to N Ghostscript processes at once when compressing per-page PDFs "
+                             "(default: number of CPUs)")
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR,
+                        help=f"directory for cached image metadata and resampled images (default: {DEFAULT_CACHE_DIR})")
+    parser.add_argument('--resample-dpi', type=int, choices=RESAMPLE_DPI_CHOICES,
+                        help="resize each image to the exact pixel size for this print DPI before embedding")
+    parser.add_argument('--add-bleed', choices=BLEED_MODES,
+                        help="give images cut to the card size the layout's bleed (1/8in), by mirroring or "
+                             "replicating their edge pixels, so cutting leaves no white slivers (cached in the "
+                             "cache directory)")
+    parser.add_argument('--color-profile', metavar='PROFILE',
+                        help=f"convert every image once to '{SRGB_PROFILE}' or to the RGB or CMYK ICC profile file "
+                             "given (e.g. the printer's), honouring each image's own profile, and embed the images "
+                             "tagged with it (conversions are cached in the cache directory)")
+    parser.add_argument('--dedupe', type=int, nargs='?', const=NEAR_DUPLICATE_DISTANCE, metavar='BITS',
+                        help="index the fronts library (cache/asset_index.sqlite, updated by modification time) and "
+                             "embed copies of the same artwork once: byte-identical files, and re-encoded or resized "
+                             f"copies whose perceptual hashes differ by at most BITS (default {NEAR_DUPLICATE_DISTANCE}; "
+                             "0 for identical files only) and whose pixels match")
+    parser.add_argument('--no-compress', action='store_true',
+                        help="skip the Ghostscript pass even if Ghostscript is installed")
+    page_mode.add_argument('--incremental', action='store_true',
+                           help="reuse finished pages from the render cache and only render pages that changed")
+    parser.add_argument('--backs', choices=['separate', 'interleave'],
+                        help="also lay out the card backs from cards.xml (common back plus per-card backs), mirrored for "
+                             "duplex printing, into backs.pdf; 'interleave' also writes duplex.pdf alternating "
+                             "front and back pages")
+    parser.add_argument('--layout', choices=list(LAYOUTS), default=DEFAULT_LAYOUT,
+                        help=f"sheet layout: paper size and card grid (default: {DEFAULT_LAYOUT}, "
+                             "the 8-up landscape letter sheet)")
+    guides = parser.add_mutually_exclusive_group()
+    guides.add_argument('--guides', choices=sorted(GUIDE_STYLES), default='template',
+                        help="cut guides to draw on every sheet: the template lines and debug points, the lines only, "
+                             "the template plus light grey dotted edge lines, or none (default: template)")
+    guides.add_argument('--template', metavar='PDF',
+                        help="stamp this template PDF beneath every sheet instead of drawing the cut guides")
+    parser.add_argument('--x-offset-cm', type=float, default=0.0, metavar='CM',
+                        help="shift the cards and edge guides right by this many centimetres to correct "
+                             "printer misalignment (default: 0)")
+    parser.add_argument('--profile', action='store_true',
+                        help="time each stage (wall and CPU), count images, Ghostscript runs and bytes written, "
+                             "print a summary table and write output/profile.jsonl")
+    parser.add_argument('--profile-cprofile', action='store_true',
+                        help="with --profile, also run cProfile and write output/profile.pstats")
+    parser.add_argument('--profile-tracemalloc', action='store_true',
+                        help="with --profile, also track peak Python memory per stage and write the top "
+                             "allocations to output/profile_tracemalloc.txt (slows the run down)")
+    return parser.parse_args()
+
 def main():
+    args = parse_args()
+    output_dir = "./output"
+    
+    if args.profile or args.profile_cprofile or args.profile_tracemalloc:
+        profiler.enable(args.profile_cprofile, args.profile_tracemalloc)
+    try:
+        build_fronts(args, output_dir)
+    finally:
+        if profiler.enabled:
+            os.makedirs(output_dir, exist_ok=True)
+            profiler.report(os.path.join(output_dir, "profile.jsonl"),
+                            os.path.join(output_dir, "profile.pstats"),
+                            os.path.join(output_dir, "profile_tracemalloc.txt"))
+
+def build_fronts(args, output_dir):
+    """Lay out the fronts (and optionally backs) for the order in assets/cards.xml"""
     # Configuration
     xml_path = "assets/cards.xml"
     fronts_dir = "assets/fronts"
-    template_pdf = "template_cut_lines.pdf"
-    output_dir = "./output"
+    backs_dir = "assets/backs"
     uncompressed_dir = os.path.join(output_dir, "uncompressed_pdfs")
     compressed_dir = os.path.join(output_dir, "compressed_pdfs")
     final_pdf = os.path.join(output_dir, "fronts.pdf")
+    backs_pdf = os.path.join(output_dir, "backs.pdf")
+    duplex_pdf = os.path.join(output_dir, "duplex.pdf")
     
-    # Set up page size (landscape 8.5x11 inches)
-    page_width, page_height = landscape(letter)
+    # Sheet layout: paper size, card grid and cut line positions
+    layout = get_layout(args.layout)
+    
+    # Cut guides are drawn straight into the pages unless a template PDF is given
+    guide_style = 'none' if args.template else args.guides
+    x_offset = args.x_offset_cm * 10 * 72 / 25.4  # Convert cm to points
     
     # Check if Ghostscript is available
-    has_ghostscript = check_and_install_ghostscript()
+    has_ghostscript = False if args.no_compress else check_and_install_ghostscript()
     
-    # Create/clean output directories
-    if os.path.exists(uncompressed_dir):
-        shutil.rmtree(uncompressed_dir)
-    os.makedirs(uncompressed_dir, exist_ok=True)
-    
-    if os.path.exists(compressed_dir):
-        shutil.rmtree(compressed_dir)
-    os.makedirs(compressed_dir, exist_ok=True)
+    os.makedirs(output_dir, exist_ok=True)
     
     # Check if required files exist
     if not os.path.exists(xml_path):
         print(f"XML file not found: {xml_path}")
         return
     
-    if not os.path.exists(template_pdf):
-        print(f"Template PDF not found: {template_pdf}")
-        print("Please run the original script first to generate the template.")
+    if args.template and not os.path.exists(args.template):
+        print(f"Template PDF not found: {args.template}")
         return
     
+    if args.color_profile:
+        try:
+            load_profile(args.color_profile)
+        except (OSError, ValueError) as e:
+            print(f"Colour profile not usable: {e}")
+            return
+    
     if not os.path.exists(fronts_dir):
         print(f"Fronts directory not found: {fronts_dir}")
         return
     
-    # Parse XML
+    if args.backs and not os.path.exists(backs_dir):
+        print(f"Backs directory not found: {backs_dir}")
+        return
+    
+    # Parse XML, checking slot ranges and duplicate slots in the same pass
     print("Parsing XML...")
-    cards = parse_xml_cards(xml_path)
+    with profiler.stage('parse_xml'):
+        order = read_order(xml_path)
+    cards = order['fronts']
     print(f"Found {len(cards)} cards in XML")
     
-    # Create slot list (now contains card IDs instead of filenames)
-    slot_list = create_slot_list(cards)
-    print(f"Total slots needed: {len(slot_list)}")
+    if order['problems']:
+        print("ERROR: Invalid slot assignments in XML:")
+        for problem in order['problems']:
+            print(f"  {problem}")
+        return
+    
+    # Create slot table (card IDs interned into a compact array)
+    with profiler.stage('slot_table'):
+        slot_table = create_slot_table(cards)
+    print(f"Total slots needed: {len(slot_table)} ({len(slot_table.card_ids)} distinct cards)")
     
-    # Check if all images exist (now searches by card ID)
+    if slot_table.collisions:
+        print("ERROR: Slots claimed by more than one card:")
+        for slot, first_id, second_id in slot_table.collisions:
+            print(f"  Slot {slot}: {first_id} and {second_id}")
+        return
+    
+    empty_slots = slot_table.gaps()
+    if empty_slots:
+        print(f"Warning: {len(empty_slots)} slots have no card and will be left blank: "
+              f"{', '.join(map(str, empty_slots[:20]))}{' ...' if len(empty_slots) > 20 else ''}")
+    
+    # Index the fronts directory once; both the check and the rendering use it
     print("\nChecking images...")
-    missing_images, existing_images = check_images_exist(slot_list, fronts_dir)
+    with profiler.stage('index_images'):
+        image_index = ImageIndex(fronts_dir)
+        print(f"Indexed {len(image_index)} images in {fronts_dir}")
+        missing_images, existing_images = check_images_exist(slot_table, image_index)
+    profiler.count('image_files_indexed', len(image_index))
+    
+    ambiguous_images = image_index.ambiguous(slot_table.card_ids)
+    if ambiguous_images:
+        print("Warning: Card IDs matching several image files (using the first):")
+        for card_id, filenames in sorted(ambiguous_images.items()):
+            print(f"  {card_id}: {', '.join(filenames)}")
     
     if missing_images:
         print("ERROR: Missing images for card IDs:")
@@ -238,93 +612,186 @@ def main():
     
     print(f"All required images found ({len(set(existing_images))} unique images)")
     
-    # Calculate pages needed (8 cards per page)
-    cards_per_page = 8
-    total_pages = (len(slot_list) + cards_per_page - 1) // cards_per_page
-    print(f"Will generate {total_pages} pages")
-    
-    # Load template PDF
-    template_reader = PdfReader(template_pdf)
-    template_page = template_reader.pages[0]
-    
-    # Generate uncompressed pages
-    print("\nGenerating uncompressed PDFs...")
-    uncompressed_files = []
-    
-    for page_num in range(total_pages):
-        start_slot = page_num * cards_per_page
-        end_slot = min(start_slot + cards_per_page, len(slot_list))
-        page_card_ids = slot_list[start_slot:end_slot]
+    # Backs use the same slots; the common back fills every slot without a card-specific back
+    if args.backs:
+        print("\nChecking card backs...")
+        with profiler.stage('index_backs'):
+            back_table = create_back_table(slot_table, order['backs'], order['cardback'])
+            back_index = ImageIndex(backs_dir)
+        if order['back_problems']:
+            print("ERROR: Invalid back slot assignments in XML:")
+            for problem in order['back_problems']:
+                print(f"  {problem}")
+            return
         
-        print(f"Page {page_num + 1}: slots {start_slot}-{end_slot - 1}")
+        print(f"Common back: {order['cardback'] or 'none'}, "
+              f"{sum(len(card['slots']) for card in order['backs'])} card-specific backs")
         
-        # Create overlay with cards (now uses card IDs)
-        overlay_packet = create_page_with_cards(page_card_ids, page_width, page_height, fronts_dir)
+        if not order['cardback']:
+            print("Warning: cards.xml has no <cardback>; slots without a card-specific back get a blank back")
         
-        # Merge with template
-        overlay_reader = PdfReader(overlay_packet)
-        output_writer = PdfWriter()
+        with profiler.stage('index_backs'):
+            missing_backs, existing_backs = check_images_exist(back_table, back_index)
+        if missing_backs:
+            print("ERROR: Missing back images for card IDs:")
+            for slot, card_id in missing_backs:
+                print(f"  Slot {slot}: {card_id}")
+            return
+        print(f"All back images found ({len(set(existing_backs))} unique images)")
+    
+    # Read sizes from the image headers, or from the cache when the files are unchanged
+    with ImageMetadataStore(args.cache_dir) as metadata_store:
+        image_paths = {image_index.path(card_id) for card_id in slot_table.card_ids}
+        if args.backs:
+            image_paths |= {back_index.path(card_id) for card_id in back_table.card_ids}
+        with profiler.stage('image_metadata'):
+            image_metadata = metadata_store.snapshot(image_paths)
+        profiler.count('image_headers_read', metadata_store.probed)
+        print(f"Image metadata: {len(image_paths) - metadata_store.probed} cached, {metadata_store.probed} read from headers")
+        for image_path, error in sorted(metadata_store.unreadable.items()):
+            print(f"  Warning: Cannot read image {os.path.basename(image_path)}: {error}")
+        # Cards whose image cannot be read are skipped when their pages are drawn
+        image_paths = set(image_metadata)
         
-        # Copy template page and merge with overlay
-        merged_page = template_page
-        if len(overlay_reader.pages) > 0:
-            overlay_page = overlay_reader.pages[0]
-            merged_page = template_page
-            merged_page.merge_page(overlay_page)
+        # Optionally point copies of the same artwork at one file, so it is encoded and embedded once
+        duplicates = {}
+        if args.dedupe is not None:
+            with profiler.stage('dedupe'), AssetIndex(fronts_dir, args.cache_dir) as asset_index:
+                added, changed, removed, unchanged = asset_index.update(args.workers)
+                duplicates = asset_index.canonical_paths(image_paths, args.dedupe)
+            print(f"Asset index: {added + changed} files indexed, {removed} removed, {unchanged} unchanged; "
+                  f"{len(duplicates)} images are copies of others and will share them")
         
-        output_writer.add_page(merged_page)
+        # The file embedded for each image: its canonical copy, then with bleed added, then resampled
+        image_sources = {image_path: duplicates.get(image_path, image_path) for image_path in image_paths}
         
-        # Save uncompressed PDF
-        uncompressed_file = os.path.join(uncompressed_dir, f"page_{page_num + 1:03d}.pdf")
-        with open(uncompressed_file, 'wb') as output_file:
-            output_writer.write(output_file)
+        # Optionally give images without bleed a generated one, so cutting leaves no white slivers
+        if args.add_bleed:
+            bleed_cache = BleedCache(args.cache_dir, args.add_bleed, metadata_store)
+            with profiler.stage('bleed'):
+                bled = bleed_cache.prepare(set(image_sources.values()), layout, args.workers)
+            image_sources = {image_path: bled[source] for image_path, source in image_sources.items()}
+            # Cards are sized from the image actually embedded, which is now taller and wider
+            image_metadata = {image_path: metadata_store.get(source) for image_path, source in image_sources.items()}
         
-        uncompressed_files.append(uncompressed_file)
-        print(f"  Saved: {uncompressed_file}")
+        # Optionally shrink the images to the print resolution once, instead of leaving it to Ghostscript
+        if args.resample_dpi:
+            resample_cache = ResampleCache(args.cache_dir, args.resample_dpi, metadata_store)
+            with profiler.stage('resample'):
+                resampled = resample_cache.prepare(set(image_sources.values()), layout.image_width, args.workers)
+            image_sources = {image_path: resampled[source] for image_path, source in image_sources.items()}
+        
+        # Optionally convert the final images to one colour profile, which goes into the PDF with them
+        color_profile_digest = None
+        if args.color_profile:
+            color_cache = ColorCache(args.cache_dir, args.color_profile, metadata_store)
+            color_profile_digest = color_cache.profile_digest
+            with profiler.stage('color'):
+                converted = color_cache.prepare(set(image_sources.values()), args.workers)
+            image_sources = {image_path: converted[source] for image_path, source in image_sources.items()}
+        
+        if args.incremental:
+            with profiler.stage('hash_images'):
+                # Pages change when the image actually embedded for a card changes
+                image_hashes = {card_id: metadata_store.content_hash(duplicates.get(image_index.path(card_id),
+                                                                                    image_index.path(card_id)))
+                                for card_id in slot_table.card_ids}
+    
+    # Calculate pages needed for the layout's cards per sheet
+    cards_per_page = layout.cards_per_page
+    print(f"Layout: {layout.name} ({layout.columns}x{layout.rows} on {layout.orientation} {layout.paper})")
+    total_pages = slot_table.page_count(cards_per_page)
+    print(f"Will generate {total_pages} pages")
     
-    # Compress PDFs if Ghostscript is available
-    compressed_files = []
-    if has_ghostscript:
-        print("\nCompressing PDFs to 1200 DPI...")
-        for uncompressed_file in uncompressed_files:
-            filename = os.path.basename(uncompressed_file)
-            compressed_file = os.path.join(compressed_dir, filename)
-            
-            if compress_pdf(uncompressed_file, compressed_file):
-                compressed_files.append(compressed_file)
-                print(f"  Compressed: {filename}")
+    # Parse a template PDF once if one was given; every page references it as a shared form
+    page_template = PageTemplate(args.template) if args.template else None
+    if page_template and [round(value, 1) for value in page_template.mediabox[2:]] != [round(value, 1) for value in layout.page_size]:
+        print(f"Warning: Template page size {page_template.mediabox[2:]} does not match the {layout.name} layout "
+              f"{list(layout.page_size)}")
+    
+    # Work out which pages changed since they were last rendered
+    page_numbers = None
+    if args.incremental:
+        render_cache = RenderCache(args.cache_dir)
+        settings = {
+            'layout': layout.describe(),
+            'template': hash_file(args.template) if args.template else None,
+            'guides': guide_style,
+            'x_offset': x_offset,
+            'resample_dpi': args.resample_dpi,
+            'dedupe': args.dedupe,
+            'bleed': args.add_bleed,
+            'color_profile': color_profile_digest,
+            'compressed': has_ghostscript
+        }
+        page_keys = [render_cache.page_key(slot_table.page(page_num, cards_per_page), image_hashes, settings)
+                     for page_num in range(total_pages)]
+        # Identical pages share a key, so each stale key is rendered once
+        page_numbers = []
+        stale_keys = set()
+        for page_num, key in enumerate(page_keys):
+            if key not in stale_keys and not render_cache.has(key):
+                stale_keys.add(key)
+                page_numbers.append(page_num)
+        print(f"Render cache: {len(set(page_keys))} distinct pages, "
+              f"{len(set(page_keys)) - len(page_numbers)} reused, {len(page_numbers)} to render")
+    
+    # Draw the pages with their cut guides, embedding each unique image once per document.  The chain
+    # plan -> render -> compress -> append is lazy: each stage pulls from the one before as it needs pages,
+    # so with --window-pages only a few windows of pages are in memory at any time.
+    print("\nDrawing card pages...")
+    documents = render_overlay_windows(slot_table, layout, image_index, image_metadata, image_sources, args.workers,
+                                       page_numbers, guide_style, x_offset, args.window_pages, args.prefetch_threads)
+    try:
+        with profiler.stage('render_and_write'):
+            if args.incremental:
+                uncached_files = write_cached_pages(page_numbers, document_pages(documents, page_template), page_keys,
+                                                    render_cache, has_ghostscript, args.gs_jobs)
+                try:
+                    combine_pages((uncached_files.get(key, render_cache.path(key)) for key in page_keys), final_pdf)
+                finally:
+                    for uncached_file in uncached_files.values():
+                        os.remove(uncached_file)
+            elif args.debug_pages:
+                compressed_files = write_debug_pages(document_pages(documents, page_template), uncompressed_dir,
+                                                     compressed_dir, has_ghostscript, args.gs_jobs)
+                combine_pages(compressed_files, final_pdf)
             else:
-                print(f"  Failed to compress: {filename}")
-                # Use uncompressed version as fallback
-                shutil.copy2(uncompressed_file, compressed_file)
-                compressed_files.append(compressed_file)
-    else:
-        print("\nSkipping compression (Ghostscript not available)")
-        # Copy uncompressed files to compressed directory
-        for uncompressed_file in uncompressed_files:
-            filename = os.path.basename(uncompressed_file)
-            compressed_file = os.path.join(compressed_dir, filename)
-            shutil.copy2(uncompressed_file, compressed_file)
-            compressed_files.append(compressed_file)
-    
-    # Combine all pages into final PDF
-    print(f"\nCombining {len(compressed_files)} pages into final PDF...")
-    final_writer = PdfWriter()
-    
-    for compressed_file in sorted(compressed_files):
-        reader = PdfReader(compressed_file)
-        for page in reader.pages:
-            final_writer.add_page(page)
+                print("\nWriting final PDF...")
+                write_document(documents, final_pdf, has_ghostscript, page_template)
+    except RuntimeError as e:
+        print(f"ERROR: {e}")
+        return
     
-    with open(final_pdf, 'wb') as output_file:
-        final_writer.write(output_file)
+    # Backs are mirrored so each one lands behind its front when the sheet is printed duplex
+    if args.backs:
+        print("\nDrawing card backs...")
+        with profiler.stage('render_backs'):
+            back_documents = render_overlay_pages(back_table, layout.mirrored(), back_index, image_metadata,
+                                                  image_sources, args.workers,
+                                                  prefetch_threads=args.prefetch_threads)
+        if back_documents is None:
+            return
+        
+        print("\nWriting backs PDF...")
+        with profiler.stage('write_backs'):
+            write_document(back_documents, backs_pdf, has_ghostscript)
+            if args.backs == 'interleave':
+                interleave_pages(final_pdf, backs_pdf, duplex_pdf)
     
     print(f"\nCompleted!")
     print(f"Final PDF: {final_pdf}")
-    print(f"Uncompressed PDFs: {uncompressed_dir}")
-    print(f"Compressed PDFs: {compressed_dir}")
+    if args.backs:
+        print(f"Backs PDF: {backs_pdf}")
+    if args.backs == 'interleave':
+        print(f"Duplex PDF: {duplex_pdf}")
+    if args.debug_pages:
+        print(f"Uncompressed PDFs: {uncompressed_dir}")
+        print(f"Compressed PDFs: {compressed_dir}")
     print(f"Total pages generated: {total_pages}")
-    print(f"Total cards printed: {len(slot_list)}")
+    print(f"Total cards printed: {len(slot_table)}")
+    if x_offset:
+        print(f"Note: Content shifted right by {args.x_offset_cm}cm")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()